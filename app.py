@@ -2,6 +2,10 @@ import subprocess
 import time
 import sys
 import os
+import requests
+
+BACKEND_URL = "http://127.0.0.1:8000"
+BACKEND_READY_TIMEOUT = float(os.getenv("BACKEND_READY_TIMEOUT", "300"))
 
 # Start FastAPI backend (app.py) using uvicorn
 backend = subprocess.Popen(
@@ -9,12 +13,24 @@ backend = subprocess.Popen(
     cwd=os.path.dirname(__file__)
 )
 
-# Wait a bit to ensure backend is up
-time.sleep(6)
+def wait_until_ready():
+    """Poll the backend's readiness probe until it is warmed up (or the backend exits)."""
+    deadline = time.time() + BACKEND_READY_TIMEOUT
+    while time.time() < deadline:
+        if backend.poll() is not None:
+            sys.exit(f"Backend exited with code {backend.returncode}")
+        try:
+            if requests.get(f"{BACKEND_URL}/health/ready", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass  # not listening yet
+        time.sleep(0.25)
+    print(f"[WARN] Backend not ready after {BACKEND_READY_TIMEOUT:.0f}s, starting the frontend anyway")
 
 try:
+    wait_until_ready()
     # Start Gradio frontend
     subprocess.run([sys.executable, "gradio_frontend.py"], cwd=os.path.dirname(__file__))
 finally:
     # Terminate backend when done
-    backend.terminate()
\ No newline at end of file
+    backend.terminate()
@@ -0,0 +1,210 @@
+import os
+import time
+import asyncio
+import pymongo
+from rag_agent import (GROQ_MODEL, MONGO_URI, compose_prompt, cache_scope, force_web_search_if_needed,
+                       format_web_results, response_cache, web_cache, get_summarizer, SESSION_DOC_FIELDS,
+                       SESSION_PROJECTION, CHAT_PROJECTION, get_retrieval_graph, collect_excerpts, GRAPH_CONFIG,
+                       get_chat_writes, merge_pending_turns)
+from summarizer import ConversationSummarizer
+from langchain_core.messages import HumanMessage
+from telemetry import span, record
+from lazy import lazy
+from llm_scheduler import scheduler as llm_scheduler, LLM_TIMEOUT_SECONDS
+
+# Async clients, so chat requests run on the event loop instead of FastAPI's threadpool; built on first use
+@lazy
+def get_async_db():
+    return pymongo.AsyncMongoClient(MONGO_URI)["Rag_Agent"]
+
+
+def get_async_chat_coll():
+    return get_async_db()["chat_history"]
+
+
+@lazy
+def get_async_groq_client():
+    from groq import AsyncGroq
+    return AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), max_retries=0, timeout=LLM_TIMEOUT_SECONDS)
+
+
+@lazy
+def get_async_tavily_client():
+    from tavily import AsyncTavilyClient
+    return AsyncTavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+
+
+WARM_UP_STEPS = {"async_clients": lambda: (get_async_db(), get_async_groq_client()),
+                 "async_tavily": get_async_tavily_client}
+OPTIONAL_WARM_UP_STEPS = ("async_tavily",)
+
+_background = set()
+
+
+def spawn(coro):
+    """Run a coroutine off the response path, keeping a reference until it finishes."""
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+async def drain_background():
+    """Wait for pending background writes, e.g. at shutdown."""
+    if _background:
+        await asyncio.gather(*_background, return_exceptions=True)
+
+
+async def aget_session_doc(user_id: str, thread_id: str) -> dict:
+    """Document and conversation summary fields of a thread (None where unset)."""
+    with span("session_fetch"):
+        doc = await get_async_db()["session_docs"].find_one({"user_id": user_id, "thread_id": thread_id},
+                                                      SESSION_PROJECTION) or {}
+    return {key: doc.get(key) for key in SESSION_DOC_FIELDS}
+
+
+async def afetch_recent_chats(user_id: str, thread_id: str, limit: int = None) -> list:
+    """Last few turns of a thread, oldest first (by default as many as the summarizer's window)."""
+    limit = limit or get_summarizer().window
+    cursor = (get_async_chat_coll().find({"user_id": user_id, "thread_id": thread_id}, CHAT_PROJECTION)
+              .sort("_id", -1).limit(limit))
+    with span("history_fetch"):
+        turns = list(reversed(await cursor.to_list(length=limit)))
+    return merge_pending_turns(turns, user_id, thread_id, limit)
+
+
+async def _atavily_search(query: str) -> str:
+    resp = await get_async_tavily_client().search(query=query, max_results=3, search_depth="advanced")
+    return format_web_results(resp)
+
+
+async def aweb_search_tool(query: str) -> str:
+    """Live web search using Tavily."""
+    with span("web_search"):
+        return await web_cache.asearch(query, _atavily_search)
+
+
+async def _no_web_result():
+    return None
+
+
+async def afetch_context(query: str, user_id: str, thread_id: str) -> dict:
+    """Fetch document context, history and web results concurrently."""
+    web = aweb_search_tool(query) if force_web_search_if_needed(query) else _no_web_result()
+    doc, recent_chats, web_result = await asyncio.gather(
+        aget_session_doc(user_id, thread_id),
+        afetch_recent_chats(user_id, thread_id),
+        web,
+    )
+    # Fetched alongside the session doc, so turns already in the summary are dropped afterwards
+    recent_chats = ConversationSummarizer.unsummarized(recent_chats, doc["summary_checkpoint"])
+    return {**doc, "recent_chats": recent_chats, "web_result": web_result}
+
+
+async def acached_answer(query: str, scope):
+    """Response cache lookup; the semantic tier embeds the query, so it runs off the loop."""
+    if not scope:
+        return None
+    with span("cache_lookup"):
+        return await asyncio.to_thread(response_cache.get, query, scope)
+
+
+async def acache_answer(query: str, scope, answer: str, user_id: str, thread_id: str):
+    if scope:
+        await asyncio.to_thread(response_cache.put, query, scope, answer, (user_id, thread_id))
+
+
+async def aretrieve(query: str, user_id: str, thread_id: str, context: dict = None):
+    """Run the retrieval stage of the graph; returns (excerpts, retrieval_ms)."""
+    state = await get_retrieval_graph().ainvoke(
+        {"messages": [HumanMessage(content=query)], "user_id": user_id, "thread_id": thread_id, "context": context},
+        config=GRAPH_CONFIG
+    )
+    retrieval_ms = state.get("retrieval_ms") or 0.0
+    return collect_excerpts(state["messages"]), retrieval_ms
+
+
+async def agroq_llm(prompt: str) -> str:
+    """Call Groq LLM through the scheduler; raises llm_scheduler.Busy when it is saturated."""
+    tokens = llm_scheduler.estimate(prompt)
+    async with llm_scheduler.aadmitted(tokens):
+        with span("llm"):
+            chat = await llm_scheduler.acall(lambda: get_async_groq_client().chat.completions.create(
+                model=GROQ_MODEL,
+                messages=[{"role": "user", "content": prompt}]
+            ))
+    llm_scheduler.settle(tokens, getattr(getattr(chat, "usage", None), "total_tokens", 0))
+    return chat.choices[0].message.content
+
+
+async def agroq_llm_stream(prompt: str):
+    """Call Groq LLM, yielding tokens as they are generated."""
+    async with llm_scheduler.aadmitted(llm_scheduler.estimate(prompt)):
+        with span("llm"):
+            start = time.perf_counter()
+            first = True
+            stream = await llm_scheduler.acall(lambda: get_async_groq_client().chat.completions.create(
+                model=GROQ_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                stream=True
+            ))
+            async for chunk in stream:
+                token = chunk.choices[0].delta.content if chunk.choices else None
+                if token:
+                    if first:
+                        record("llm_first_token", time.perf_counter() - start)
+                        first = False
+                    yield token
+
+
+async def asave_turn(user_id: str, thread_id: str, query: str, answer: str, retrieval_ms: float = None,
+                     turn_id=None):
+    """Queue one question/answer pair for writing, under turn_id if given."""
+    turn = {
+        "user_id": user_id,
+        "thread_id": thread_id,
+        "query": query,
+        "response": answer,
+        "retrieval_ms": retrieval_ms
+    }
+    if turn_id is not None:
+        turn["_id"] = turn_id
+    try:
+        with span("history_write"):
+            await get_chat_writes().aadd(turn)
+        get_summarizer().schedule(user_id, thread_id)
+    except Exception as e:
+        print(f"[ERROR] Failed to save chat turn for thread {thread_id}: {e}")
+
+
+async def arun_agent_with_query(query: str, user_id: str, thread_id: str, turn_id=None) -> str:
+    """Async run_agent_with_query; the history write happens after the answer is returned."""
+    context = await afetch_context(query, user_id, thread_id)
+    scope = cache_scope(context, user_id, thread_id)
+    answer = await acached_answer(query, scope)
+    retrieval_ms = None
+    if answer is None:
+        context["excerpts"], retrieval_ms = await aretrieve(query, user_id, thread_id, context)
+        answer = await agroq_llm(compose_prompt(query, context))
+        spawn(acache_answer(query, scope, answer, user_id, thread_id))
+    spawn(asave_turn(user_id, thread_id, query, answer, retrieval_ms, turn_id))
+    return answer
+
+
+async def astream_agent_with_query(query: str, user_id: str, thread_id: str, turn_id=None):
+    """Async stream_agent_with_query."""
+    context = await afetch_context(query, user_id, thread_id)
+    scope = cache_scope(context, user_id, thread_id)
+    cached = await acached_answer(query, scope)
+    if cached is not None:
+        yield cached
+        spawn(asave_turn(user_id, thread_id, query, cached, turn_id=turn_id))
+        return
+    context["excerpts"], retrieval_ms = await aretrieve(query, user_id, thread_id, context)
+    tokens = []
+    async for token in agroq_llm_stream(compose_prompt(query, context)):
+        tokens.append(token)
+        yield token
+    answer = "".join(tokens)
+    spawn(acache_answer(query, scope, answer, user_id, thread_id))
+    spawn(asave_turn(user_id, thread_id, query, answer, retrieval_ms, turn_id))
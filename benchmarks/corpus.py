@@ -0,0 +1,68 @@
+"""Synthetic financial-report PDFs and queries for the benchmark."""
+import random
+
+COMPANIES = ("ACME", "Globex", "Initech", "Umbrella", "Stark", "Wayne", "Hooli", "Vandelay")
+LINE_ITEMS = ("revenue", "gross margin", "operating income", "net income", "free cash flow",
+              "capital expenditure", "EBITDA", "diluted EPS", "long-term debt", "R&D expense")
+SENTENCES = (
+    "{company} reported {item} of {value} million dollars in FY{year}, compared with {prior} million a year earlier.",
+    "Management attributed the change in {item} to pricing, product mix and currency movements in FY{year}.",
+    "The board expects {item} to remain under pressure in FY{next_year} as input costs stay elevated.",
+    "Segment disclosures in the {form} show {item} concentrated in North America and Europe.",
+    "{company} repurchased {value} million dollars of shares and kept its dividend unchanged.",
+)
+
+
+def page_text(doc: int, page: int, words: int = 450) -> str:
+    rng = random.Random(doc * 100003 + page)
+    company = COMPANIES[doc % len(COMPANIES)]
+    parts = [f"{company} annual report, page {page + 1}."]
+    while sum(len(p.split()) for p in parts) < words:
+        year = rng.randint(2018, 2024)
+        parts.append(rng.choice(SENTENCES).format(
+            company=company, item=rng.choice(LINE_ITEMS), value=rng.randint(10, 9000),
+            prior=rng.randint(10, 9000), year=year, next_year=year + 1, form=rng.choice(("10-K", "10-Q", "20-F"))))
+    return " ".join(parts)
+
+
+def make_pdf(pages) -> bytes:
+    """Minimal PDF with one Helvetica text page per string."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for i, text in enumerate(pages):
+        page_id = 4 + 2 * i
+        kids.append(f"{page_id} 0 R")
+        escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        lines = [escaped[j:j + 90] for j in range(0, len(escaped), 90)]
+        body = "BT /F1 9 Tf 30 810 Td 11 TL " + " ".join(f"({line}) '" for line in lines) + " ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> "
+                       f"/Contents {page_id + 1} 0 R >>".encode())
+        objects.append(f"<< /Length {len(body)} >>\nstream\n{body}\nendstream".encode())
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(pages)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(out))
+        out += f"{i + 1} 0 obj\n".encode() + obj + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def make_report(doc: int, pages: int) -> bytes:
+    return make_pdf([page_text(doc, p) for p in range(pages)])
+
+
+def make_query(i: int, web_fraction: float) -> str:
+    """Distinct questions, so the response cache doesn't answer them; some trigger a web search."""
+    rng = random.Random(i)
+    item = rng.choice(LINE_ITEMS)
+    year = rng.randint(2018, 2024)
+    if rng.random() < web_fraction:
+        return f"What is the latest news on {item} for {rng.choice(COMPANIES)} (question {i})?"
+    return f"How did {item} change in FY{year} and what drove it (question {i})?"
@@ -0,0 +1,129 @@
+"""Recall, memory and latency of quantized candidate search in the local vector store.
+
+    python benchmarks/quantization.py --docs 40 --pages 50 --queries 200
+
+Embeds the synthetic report corpus once, stores it in a throwaway local
+shard per quantization mode, and compares each mode's top-k with an exact
+float32 scan. Writes a JSON report to --output.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import tempfile
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import stubs
+from benchmarks.corpus import page_text, make_query
+from benchmarks.run import percentiles, git_commit
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=40, help="documents in the corpus")
+    parser.add_argument("--pages", type=int, default=50, help="pages per document")
+    parser.add_argument("--queries", type=int, default=200, help="queries timed per configuration")
+    parser.add_argument("--k", type=int, default=5, help="results per query (RETRIEVER_K)")
+    parser.add_argument("--rescore-factors", default="1,2,4,10",
+                        help="comma-separated RESCORE_FACTOR values tried for each quantized mode")
+    parser.add_argument("--ivf-min", type=int, default=None, help="override IVF_MIN_VECTORS to exercise IVF")
+    parser.add_argument("--real-embeddings", action="store_true", help="load the real embedding model")
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results", "quantization.json"))
+    return parser.parse_args()
+
+
+def corpus_chunks(docs: int, pages: int) -> list:
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    return [chunk for d in range(docs) for p in range(pages) for chunk in splitter.split_text(page_text(d, p))]
+
+
+# Files read when scoring candidates; float32 is otherwise only touched for the rescored rows
+SCANNED_FILES = {"none": ("vectors.f32",), "float16": ("vectors.float16",), "int8": ("vectors.int8", "scales.f32")}
+
+
+def shard_bytes(path: str) -> dict:
+    sizes = {}
+    for root, _, files in os.walk(path):
+        for name in files:
+            sizes[name] = sizes.get(name, 0) + os.path.getsize(os.path.join(root, name))
+    return sizes
+
+
+def measure(store, owner: dict, queries: np.ndarray, truth: list, k: int) -> dict:
+    owner_filter = {key: {"$eq": value} for key, value in owner.items()}
+    store.similarity_search_by_vector_with_score(queries[0].tolist(), k, owner_filter)  # map files, build codes
+    latencies, hits = [], 0
+    for q, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = store.similarity_search_by_vector_with_score(q.tolist(), k, owner_filter)
+        latencies.append(time.perf_counter() - start)
+        hits += len({doc.id for doc, _ in found} & expected)
+    return {"recall": round(hits / (k * len(queries)), 4), "latency": percentiles(latencies)}
+
+
+def main():
+    args = parse_args()
+    import local_vector_store
+    from local_vector_store import LocalVectorStore
+    if args.ivf_min is not None:
+        local_vector_store.IVF_MIN_VECTORS = args.ivf_min
+    if args.real_embeddings:
+        from embeddings import get_embedding_model
+        embedder = get_embedding_model()
+    else:
+        embedder = stubs.StubEmbeddings()
+
+    texts = corpus_chunks(args.docs, args.pages)
+    start = time.perf_counter()
+    vectors = np.asarray(embedder.embed_documents(texts), dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    embed_s = time.perf_counter() - start
+    queries = np.asarray([embedder.embed_query(make_query(i, 0)) for i in range(args.queries)], dtype=np.float32)
+    queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    ids = [str(i) for i in range(len(texts))]
+    truth = [set(ids[i] for i in np.argsort(-(vectors @ q))[:args.k]) for q in queries]
+
+    owner = {"user_id": "benchmark", "thread_id": "quantization"}
+    factors = [int(f) for f in args.rescore_factors.split(",")]
+    configs = [("none", 1)] + [(mode, f) for mode in ("float16", "int8") for f in factors]
+    results = []
+    for mode, factor in configs:
+        path = tempfile.mkdtemp(prefix=f"rag_quant_{mode}_")
+        store = LocalVectorStore(embedder, path=path, quantization=mode, rescore_factor=factor)
+        store.add_vectors(texts, vectors, [dict(owner) for _ in texts], ids=ids)
+        result = measure(store, owner, queries, truth, args.k)
+        sizes = shard_bytes(path)
+        search_bytes = sum(sizes.get(name, 0) for name in SCANNED_FILES[mode])
+        results.append({"quantization": mode, "rescore_factor": factor if mode != "none" else None, **result,
+                        "scanned_mb": round(search_bytes / 2 ** 20, 2), "disk_mb": round(sum(sizes.values()) / 2 ** 20, 2),
+                        "bytes_per_vector_scanned": round(search_bytes / len(texts), 1)})
+
+    report = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "config": vars(args),
+        "vectors": len(texts),
+        "dimensions": int(vectors.shape[1]),
+        "embedding_s": round(embed_s, 2),
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{len(texts)} vectors x {vectors.shape[1]} dims, {args.queries} queries, k={args.k}")
+    print(f"{'mode':<8} {'rescore':>7} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'scanned MiB':>12} {'disk MiB':>9}")
+    for r in results:
+        print(f"{r['quantization']:<8} {str(r['rescore_factor'] or '-'):>7} {r['recall']:>7.3f} "
+              f"{r['latency']['p50_ms']:>8.2f} {r['latency']['p95_ms']:>8.2f} {r['scanned_mb']:>12.2f} {r['disk_mb']:>9.2f}")
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
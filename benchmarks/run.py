@@ -0,0 +1,291 @@
+"""Offline end-to-end benchmark: uploads and chats against main:app with stand-in services.
+
+    python benchmarks/run.py --docs 4 --pages 40 --chats 200 --concurrency 16
+
+Writes a JSON report (ingestion pages/sec, chat latency percentiles,
+throughput, peak RSS) to --output.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import datetime
+import resource
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import stubs
+from benchmarks.corpus import make_report, make_query
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=4, help="documents uploaded, one per thread")
+    parser.add_argument("--pages", type=int, default=40, help="pages per document")
+    parser.add_argument("--chats", type=int, default=200, help="chat requests sent")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight at once")
+    parser.add_argument("--stream", action="store_true", help="use /chat/stream and record time to first token")
+    parser.add_argument("--web-fraction", type=float, default=0.1, help="share of questions that trigger web search")
+    parser.add_argument("--llm-first-token-ms", type=float, default=300)
+    parser.add_argument("--llm-token-ms", type=float, default=10)
+    parser.add_argument("--llm-tokens", type=int, default=60)
+    parser.add_argument("--search-ms", type=float, default=500)
+    parser.add_argument("--db-ms", type=float, default=1)
+    parser.add_argument("--embed-ms-per-chunk", type=float, default=0,
+                        help="simulated embedding cost; ignored with --real-embeddings")
+    parser.add_argument("--real-embeddings", action="store_true", help="load the real embedding model")
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results", "latest.json"))
+    return parser.parse_args()
+
+
+def configure(args):
+    """Point the app at stand-ins and throwaway local indexes; must run before importing main."""
+    workdir = tempfile.mkdtemp(prefix="rag_bench_")
+    os.environ.update({
+        "MONGODB_URI": "mongodb://benchmark",
+        "GROQ_API_KEY": "benchmark",
+        "TAVILY_API_KEY": "benchmark",
+        "VECTOR_BACKEND": "local",
+        "LOCAL_INDEX_DIR": os.path.join(workdir, "vector_index"),
+        "LEXICAL_INDEX_DIR": os.path.join(workdir, "lexical_index"),
+    })
+    stubs.Latency.llm_first_token = args.llm_first_token_ms / 1000
+    stubs.Latency.llm_per_token = args.llm_token_ms / 1000
+    stubs.Latency.llm_tokens = args.llm_tokens
+    stubs.Latency.search = args.search_ms / 1000
+    stubs.Latency.db = args.db_ms / 1000
+    stubs.Latency.embed_per_chunk = args.embed_ms_per_chunk / 1000
+    stubs.install(embeddings=not args.real_embeddings)
+
+
+def percentiles(samples) -> dict:
+    if not samples:
+        return {}
+    values = np.asarray(samples) * 1000
+    return {"count": len(samples), "mean_ms": round(float(values.mean()), 2),
+            **{f"p{p}_ms": round(float(np.percentile(values, p)), 2) for p in (50, 95, 99)},
+            "max_ms": round(float(values.max()), 2)}
+
+
+def _rss_mb(pid) -> float:
+    """Current resident set size from /proc (Linux only; 0 elsewhere)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class RssSampler:
+    """Samples the RSS of this process plus its parse workers, keeping the peak."""
+
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            total = _rss_mb("self") + sum(_rss_mb(p.pid) for p in multiprocessing.active_children())
+            self.peak = max(self.peak, total)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self) -> dict:
+        scale = 1 / (1024 * 1024) if sys.platform == "darwin" else 1 / 1024  # ru_maxrss: bytes on macOS, KiB on Linux
+        return {"process": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, 1),
+                "with_workers": round(self.peak, 1) or None}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+class Server:
+    """main:app under uvicorn on a free local port, in a background thread."""
+
+    def __init__(self):
+        import uvicorn
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config("main:app", host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("Benchmark server failed to start")
+            time.sleep(0.05)
+        return f"http://127.0.0.1:{self.port}"
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+async def ingest(client, args) -> dict:
+    """Upload one document per new thread and wait for every job to finish."""
+    threads = [(await client.post("/threads/new")).json()["thread_id"] for _ in range(args.docs)]
+    pdfs = [make_report(i, args.pages) for i in range(args.docs)]
+    gate = asyncio.Semaphore(args.concurrency)
+
+    async def upload(i):
+        async with gate:
+            resp = await client.post("/upload", data={"thread_id": threads[i]},
+                                     files={"file": (f"report_{i}.pdf", pdfs[i], "application/pdf")})
+            job_id = resp.json().get("job_id")
+            if job_id is None:
+                return {"status": "rejected", "elapsed": None}
+            while True:
+                job = (await client.get(f"/jobs/{job_id}")).json()
+                if job["status"] in ("done", "failed"):
+                    return job
+                await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    jobs = await asyncio.gather(*(upload(i) for i in range(args.docs)))
+    elapsed = time.perf_counter() - start
+    done = [j for j in jobs if j["status"] == "done"]
+    pages = sum(j["progress"].get("parsed_pages", 0) for j in done)
+    return {
+        "threads": threads,
+        "documents": args.docs,
+        "succeeded": len(done),
+        "pages": pages,
+        "chunks": sum(j["progress"].get("stored", 0) for j in done),
+        "elapsed_s": round(elapsed, 3),
+        "pages_per_sec": round(pages / elapsed, 2) if elapsed else None,
+        "job_latency": percentiles([j["elapsed"] for j in done]),
+    }
+
+
+async def chat(client, args, threads) -> dict:
+    """Send args.chats questions across the threads, args.concurrency at a time."""
+    gate = asyncio.Semaphore(args.concurrency)
+    latencies, first_tokens, errors, busy = [], [], 0, 0
+
+    async def ask(i):
+        nonlocal errors, busy
+        data = {"query": make_query(i, args.web_fraction), "thread_id": threads[i % len(threads)]}
+        async with gate:
+            start = time.perf_counter()
+            try:
+                if args.stream:
+                    first = None
+                    async with client.stream("POST", "/chat/stream", data=data) as resp:
+                        if resp.status_code == 503:
+                            busy += 1
+                            return
+                        event = None
+                        async for line in resp.aiter_lines():
+                            if line.startswith("event:"):
+                                event = line[len("event:"):].strip()
+                            elif line.startswith("data:"):
+                                if event == "error":
+                                    if '"busy": true' in line:
+                                        busy += 1
+                                        return
+                                    raise RuntimeError("stream error")
+                                if first is None:
+                                    first = time.perf_counter() - start
+                    first_tokens.append(first)
+                else:
+                    resp = await client.post("/chat", data=data)
+                    if resp.status_code == 503:
+                        busy += 1
+                        return
+                    resp.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(ask(i) for i in range(args.chats)))
+    elapsed = time.perf_counter() - start
+    result = {
+        "endpoint": "/chat/stream" if args.stream else "/chat",
+        "requests": args.chats,
+        "errors": errors,
+        "busy": busy,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency": percentiles(latencies),
+    }
+    if args.stream:
+        result["first_token"] = percentiles([t for t in first_tokens if t is not None])
+    return result
+
+
+async def wait_ready(client, timeout: float = 300):
+    """Let the app finish warming up, so the measurements don't include it."""
+    deadline = time.perf_counter() + timeout
+    while (await client.get("/health/ready")).status_code != 200:
+        if time.perf_counter() > deadline:
+            raise RuntimeError("App did not become ready")
+        await asyncio.sleep(0.1)
+
+
+async def run(args, base_url) -> dict:
+    import httpx
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        await wait_ready(client)
+        ingestion = await ingest(client, args)
+        chats = await chat(client, args, ingestion.pop("threads")) if args.chats else None
+        stats = (await client.get("/stats")).json()
+    return {"ingestion": ingestion, "chat": chats, "caches": stats}
+
+
+def main():
+    args = parse_args()
+    configure(args)
+    with RssSampler() as rss, Server() as base_url:
+        results = asyncio.run(run(args, base_url))
+    report = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "config": vars(args),
+        **results,
+        "peak_rss_mb": rss.report(),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    ingestion, chats = report["ingestion"], report["chat"]
+    print(f"Ingestion: {ingestion['pages']} pages in {ingestion['elapsed_s']}s ({ingestion['pages_per_sec']} pages/sec)")
+    if chats:
+        latency = chats["latency"]
+        print(f"Chat: {chats['throughput_rps']} req/s, p50 {latency.get('p50_ms')} ms, p95 {latency.get('p95_ms')} ms, "
+              f"p99 {latency.get('p99_ms')} ms, {chats['errors']} errors, {chats['busy']} shed as busy")
+    print(f"Peak RSS: {report['peak_rss_mb']['process']} MiB (with parse workers {report['peak_rss_mb']['with_workers']} MiB)")
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""Local stand-ins for Groq, Tavily, MongoDB and the embedding model, with configurable latency.
+
+install() must run before the app builds its clients. They are built lazily,
+on first use or by warm-up, so calling it before rag_agent is imported (as the
+benchmarks do) is enough.
+"""
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+import numpy as np
+import xxhash
+
+
+class Latency:
+    """Simulated service latencies in seconds, set from the command line."""
+    llm_first_token = 0.3
+    llm_per_token = 0.01
+    llm_tokens = 60
+    search = 0.5
+    db = 0.001
+    embed_per_chunk = 0.0
+
+
+ANSWER_WORDS = ("Based on the document , revenue grew in the fiscal year while operating margin "
+                "was stable and the outlook remains cautious .").split()
+
+
+def _answer_tokens():
+    return [(" " if i else "") + ANSWER_WORDS[i % len(ANSWER_WORDS)] for i in range(Latency.llm_tokens)]
+
+
+def _completion(tokens):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="".join(tokens)))],
+                           usage=SimpleNamespace(total_tokens=len(tokens)))
+
+
+def _chunk(token):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+
+
+class _Completions:
+    def create(self, model, messages, stream=False, **kwargs):
+        tokens = _answer_tokens()
+        if not stream:
+            time.sleep(Latency.llm_first_token + Latency.llm_per_token * len(tokens))
+            return _completion(tokens)
+
+        def chunks():
+            time.sleep(Latency.llm_first_token)
+            for token in tokens:
+                time.sleep(Latency.llm_per_token)
+                yield _chunk(token)
+        return chunks()
+
+
+class _AsyncCompletions:
+    async def create(self, model, messages, stream=False, **kwargs):
+        tokens = _answer_tokens()
+        if not stream:
+            await asyncio.sleep(Latency.llm_first_token + Latency.llm_per_token * len(tokens))
+            return _completion(tokens)
+
+        async def chunks():
+            await asyncio.sleep(Latency.llm_first_token)
+            for token in tokens:
+                await asyncio.sleep(Latency.llm_per_token)
+                yield _chunk(token)
+        return chunks()
+
+
+class StubGroq:
+    def __init__(self, api_key=None, **kwargs):
+        self.chat = SimpleNamespace(completions=_Completions())
+
+
+class StubAsyncGroq:
+    def __init__(self, api_key=None, **kwargs):
+        self.chat = SimpleNamespace(completions=_AsyncCompletions())
+
+
+def _search_results(query):
+    return {"results": [{"title": f"Result {i} for {query}", "url": f"https://example.com/{i}",
+                         "content": f"Recent coverage of {query}: figures were updated this quarter."}
+                        for i in range(3)]}
+
+
+class StubTavily:
+    def __init__(self, api_key=None, **kwargs):
+        pass
+
+    def search(self, query, **kwargs):
+        time.sleep(Latency.search)
+        return _search_results(query)
+
+
+class StubAsyncTavily:
+    def __init__(self, api_key=None, **kwargs):
+        pass
+
+    async def search(self, query, **kwargs):
+        await asyncio.sleep(Latency.search)
+        return _search_results(query)
+
+
+class StubEmbeddings:
+    """Hashed bag-of-words vectors: deterministic, and texts sharing words score as similar."""
+
+    def __init__(self, model_name=None, encode_kwargs=None, dimensions: int = 384, **kwargs):
+        self.dimensions = dimensions
+
+    def _embed(self, text):
+        vec = np.zeros(self.dimensions, dtype=np.float32)
+        for word in text.lower().split():
+            vec[xxhash.xxh32_intdigest(word.encode("utf-8")) % self.dimensions] += 1.0
+        norm = np.linalg.norm(vec)
+        return (vec / norm if norm else vec).tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(Latency.embed_per_chunk * len(texts))
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class _SlowCollection:
+    """Sync collection whose calls each take Latency.db."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            time.sleep(Latency.db)
+            return attr(*args, **kwargs)
+        return call
+
+
+class _SlowDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, name):
+        return _SlowCollection(self._database[name])
+
+    def __getattr__(self, name):
+        return getattr(self._database, name)
+
+
+class StubMongoClient:
+    """In-memory MongoDB (mongomock) shared by every client in the process."""
+
+    _shared = None
+    _lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        import mongomock
+        with StubMongoClient._lock:
+            if StubMongoClient._shared is None:
+                StubMongoClient._shared = mongomock.MongoClient()
+        self._client = StubMongoClient._shared
+
+    def __getitem__(self, name):
+        return _SlowDatabase(self._client[name])
+
+
+class _AsyncCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, n):
+        self._cursor = self._cursor.limit(n)
+        return self
+
+    async def to_list(self, length=None):
+        await asyncio.sleep(Latency.db)
+        return list(self._cursor)[:length] if length else list(self._cursor)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await asyncio.sleep(Latency.db)
+        for doc in self._cursor:
+            yield doc
+
+
+class _AsyncCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return _AsyncCursor(self._collection.find(*args, **kwargs))
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(Latency.db)
+            return attr(*args, **kwargs)
+        return call
+
+
+class _AsyncDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, name):
+        return _AsyncCollection(self._database[name])
+
+
+class StubAsyncMongoClient(StubMongoClient):
+    def __getitem__(self, name):
+        return _AsyncDatabase(self._client[name])
+
+
+def _patch_mongomock():
+    """pymongo's UpdateOne passes sort= to bulk builders, which mongomock doesn't accept yet."""
+    import mongomock.collection
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+
+    def patched(self, *args, sort=None, **kwargs):
+        return add_update(self, *args, **kwargs)
+    mongomock.collection.BulkOperationBuilder.add_update = patched
+
+
+def install(embeddings: bool = True):
+    """Swap the service clients the app imports for the stand-ins above."""
+    import pymongo
+    import groq
+    import tavily
+    import langchain_community.embeddings
+    _patch_mongomock()
+    pymongo.MongoClient = StubMongoClient
+    pymongo.AsyncMongoClient = StubAsyncMongoClient
+    groq.Groq = StubGroq
+    groq.AsyncGroq = StubAsyncGroq
+    tavily.TavilyClient = StubTavily
+    tavily.AsyncTavilyClient = StubAsyncTavily
+    if embeddings:
+        langchain_community.embeddings.HuggingFaceEmbeddings = StubEmbeddings
@@ -0,0 +1,107 @@
+import os
+import threading
+from typing import List
+from telemetry import register, Counter
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+MIN_TRUNCATED_TOKENS = 32  # don't keep slivers of a piece smaller than this
+
+prompt_tokens_total = register(Counter("rag_prompt_tokens_total", "Prompt tokens packed, by section.", ("section",)))
+prompt_trimmed_total = register(Counter("rag_prompt_trimmed_total", "Prompt pieces cut to fit the token budget.",
+                                        ("section", "action")))
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+class ApproxEncoding:
+    """~4 characters per token, used when the tiktoken encoding can't be loaded (e.g. offline)."""
+
+    def encode(self, text: str, **kwargs) -> List[str]:
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+    def decode(self, tokens: List[str]) -> str:
+        return "".join(tokens)
+
+
+def get_encoding():
+    """tiktoken encoding used to approximate the LLM's token counts, loaded once."""
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+                except Exception as e:
+                    print(f"[WARN] Could not load tiktoken encoding {TOKENIZER_ENCODING}, approximating token counts: {e}")
+                    _encoding = ApproxEncoding()
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+
+class ContextPacker:
+    """Fills a token budget with prompt sections in the order they are added.
+
+    Each section is a list of pieces ordered from most to least valuable.
+    Pieces that no longer fit are truncated (if the section allows it) or
+    dropped, so the least valuable content goes first. A contiguous section
+    stops at its first piece that does not fit rather than skipping ahead
+    to smaller ones, so it never has gaps.
+    """
+
+    def __init__(self, budget: int = PROMPT_TOKEN_BUDGET):
+        self.budget = budget
+        self._sections = []
+
+    def add(self, name: str, pieces: List[str], truncate: bool = True, required: bool = False,
+            contiguous: bool = False):
+        """Queue a section; required sections are always kept whole."""
+        self._sections.append((name, [p for p in pieces if p], truncate, required, contiguous))
+        return self
+
+    def pack(self):
+        """Return ({name: kept pieces}, {name: {"tokens", "kept", "truncated", "dropped"}})."""
+        enc = get_encoding()
+        remaining = self.budget
+        encoded = {name: [enc.encode(p, disallowed_special=()) for p in pieces]
+                   for name, pieces, _, _, _ in self._sections}
+        for name, _, _, required, _ in self._sections:
+            if required:
+                remaining -= sum(len(t) for t in encoded[name])
+
+        packed, usage = {}, {}
+        for name, pieces, truncate, required, contiguous in self._sections:
+            kept, used, truncated, dropped = [], 0, 0, 0
+            for i, (piece, tokens) in enumerate(zip(pieces, encoded[name])):
+                if required:
+                    kept.append(piece)
+                    used += len(tokens)
+                elif len(tokens) <= remaining:
+                    kept.append(piece)
+                    used += len(tokens)
+                    remaining -= len(tokens)
+                elif truncate and remaining >= MIN_TRUNCATED_TOKENS:
+                    kept.append(enc.decode(tokens[:remaining]) + " …")
+                    used += remaining
+                    remaining = 0
+                    truncated += 1
+                elif contiguous:
+                    dropped += len(pieces) - i
+                    break
+                else:
+                    dropped += 1
+            packed[name] = kept
+            usage[name] = {"tokens": used, "kept": len(kept), "truncated": truncated, "dropped": dropped}
+            prompt_tokens_total.inc(name, amount=used)
+            if truncated:
+                prompt_trimmed_total.inc(name, "truncated", amount=truncated)
+            if dropped:
+                prompt_trimmed_total.inc(name, "dropped", amount=dropped)
+        usage["total"] = sum(u["tokens"] for u in usage.values())
+        usage["budget"] = self.budget
+        return packed, usage
@@ -0,0 +1,141 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import List
+import numpy as np
+import xxhash
+from pymongo import UpdateOne
+from langchain_core.embeddings import Embeddings
+
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+EMBED_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBED_CACHE_MEMORY_ENTRIES", "5000"))
+QUERY_CACHE_ENTRIES = 256
+
+
+def chunk_hash(text: str, model_name: str) -> str:
+    """Content hash of a chunk for a given model."""
+    return xxhash.xxh3_128_hexdigest(f"{model_name}\0{text}".encode("utf-8"))
+
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    """Content hash of a file, read in blocks."""
+    h = xxhash.xxh3_128()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """Chunk embeddings persisted in Mongo with a small in-process LRU in front."""
+
+    def __init__(self, collection, max_entries: int = EMBED_CACHE_MAX_ENTRIES,
+                 memory_entries: int = EMBED_CACHE_MEMORY_ENTRIES):
+        self.collection = collection
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remember(self, key: str, vector):
+        with self._lock:
+            self._memory[key] = np.asarray(vector, dtype=np.float32)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get_many(self, keys: List[str]) -> dict:
+        """Return {key: vector} for every cached key."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+        missing = [k for k in set(keys) if k not in found]
+        if missing:
+            for doc in self.collection.find({"_id": {"$in": missing}}, {"embedding": 1}):
+                found[doc["_id"]] = doc["embedding"]
+                self._remember(doc["_id"], doc["embedding"])
+        if found:
+            self.collection.update_many({"_id": {"$in": list(found)}}, {"$set": {"last_used": time.time()}})
+        with self._lock:
+            hits = sum(1 for k in keys if k in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, entries: dict):
+        """Store {key: vector} and evict the least recently used entries past the size bound."""
+        if not entries:
+            return
+        now = time.time()
+        self.collection.bulk_write([
+            UpdateOne({"_id": key}, {"$set": {"embedding": [float(x) for x in vector], "last_used": now}}, upsert=True)
+            for key, vector in entries.items()
+        ], ordered=False)
+        for key, vector in entries.items():
+            self._remember(key, vector)
+        self._evict()
+
+    def _evict(self):
+        overflow = self.collection.estimated_document_count() - self.max_entries
+        if overflow <= 0:
+            return
+        stale = [d["_id"] for d in self.collection.find({}, {"_id": 1}).sort("last_used", 1).limit(overflow)]
+        if stale:
+            self.collection.delete_many({"_id": {"$in": stale}})
+            with self._lock:
+                for key in stale:
+                    self._memory.pop(key, None)
+                self.evictions += len(stale)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "memory_entries": len(self._memory),
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings that only encode chunks missing from the cache."""
+
+    def __init__(self, engine, cache: EmbeddingCache):
+        self.engine = engine
+        self.cache = cache
+        self._queries = OrderedDict()
+        self._query_lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [chunk_hash(t, self.engine.model_name) for t in texts]
+        found = self.cache.get_many(keys)
+        todo = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in todo:
+                todo[key] = text
+        if todo:
+            fresh = dict(zip(todo, self.engine.embed_documents(list(todo.values()))))
+            self.cache.put_many(fresh)
+            found.update(fresh)
+        return [[float(x) for x in found[k]] for k in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Retrieval and MMR both embed the same query, so the last few are kept
+        with self._query_lock:
+            if text in self._queries:
+                self._queries.move_to_end(text)
+                return self._queries[text]
+        vector = self.engine.embed_query(text)
+        with self._query_lock:
+            self._queries[text] = vector
+            while len(self._queries) > QUERY_CACHE_ENTRIES:
+                self._queries.popitem(last=False)
+        return vector
@@ -0,0 +1,74 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from langchain_core.embeddings import Embeddings
+
+EMBED_MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", str(min(4, os.cpu_count() or 1))))
+
+
+class EmbeddingEngine(Embeddings):
+    """Shared embedding model, loaded once and encoded in batches on a bounded thread pool."""
+
+    def __init__(self, model_name: str = EMBED_MODEL_NAME, batch_size: int = EMBED_BATCH_SIZE,
+                 threads: int = EMBED_THREADS):
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.threads = max(1, threads)
+        self._model = None
+        self._pool = None
+        self._lock = threading.Lock()
+        self.last_rate = 0.0  # chunks/sec of the most recent embed_documents call
+
+    def _load(self):
+        """Load the model and worker pool on first use."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from langchain_community.embeddings import HuggingFaceEmbeddings
+                    start = time.perf_counter()
+                    model = HuggingFaceEmbeddings(
+                        model_name=self.model_name,
+                        encode_kwargs={"batch_size": self.batch_size},
+                    )
+                    self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="embed")
+                    self._model = model
+                    print(f"[INFO] Loaded embedding model {self.model_name} in {time.perf_counter() - start:.2f}s")
+        return self._model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed chunks in batches across the worker pool, preserving order."""
+        if not texts:
+            return []
+        model = self._load()
+        start = time.perf_counter()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            vectors = model.embed_documents(batches[0])
+        else:
+            vectors = [v for batch in self._pool.map(model.embed_documents, batches) for v in batch]
+        elapsed = time.perf_counter() - start
+        self.last_rate = len(texts) / elapsed if elapsed > 0 else float("inf")
+        print(f"[INFO] Embedded {len(texts)} chunks in {elapsed:.2f}s ({self.last_rate:.1f} chunks/sec)")
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query."""
+        return self._load().embed_query(text)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_embedding_model() -> EmbeddingEngine:
+    """Return the process-wide embedding engine."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = EmbeddingEngine()
+    return _engine
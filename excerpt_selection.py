@@ -0,0 +1,121 @@
+import os
+from typing import Callable, List, Optional
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+MMR_FETCH_K = int(os.getenv("MMR_FETCH_K", "20"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+
+
+def mmr(query_vec: np.ndarray, doc_vecs: np.ndarray, k: int, lambda_mult: float = MMR_LAMBDA,
+        prior: Optional[np.ndarray] = None) -> List[int]:
+    """Maximal marginal relevance: indices of k rows balancing query similarity and novelty.
+
+    prior, if given, is averaged into the query similarity, e.g. to respect an
+    upstream ranking.
+    """
+    n = len(doc_vecs)
+    if n == 0:
+        return []
+    docs = doc_vecs / np.maximum(np.linalg.norm(doc_vecs, axis=1, keepdims=True), 1e-12)
+    q = query_vec / max(float(np.linalg.norm(query_vec)), 1e-12)
+    relevance = docs @ q
+    if prior is not None:
+        relevance = (relevance + prior) / 2
+    pairwise = docs @ docs.T
+    selected = [int(np.argmax(relevance))]
+    redundancy = pairwise[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < min(k, n):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, pairwise[best], out=redundancy)
+    return selected
+
+
+def _span_key(doc: Document):
+    meta = doc.metadata
+    if meta.get("start_index") is None:
+        return None
+    return meta.get("doc_hash") or meta.get("source"), meta.get("page")
+
+
+def merge_spans(docs: List[Document]) -> List[Document]:
+    """Merge chunks of the same page that overlap or touch into one contiguous excerpt.
+
+    Needs start_index metadata; other chunks are kept as they are (minus exact
+    duplicates). Merged excerpts take the position of their best-ranked chunk.
+    """
+    groups, order, seen = {}, [], set()
+    for rank, doc in enumerate(docs):
+        if doc.page_content in seen:
+            continue
+        seen.add(doc.page_content)
+        key = _span_key(doc)
+        if key is None:
+            order.append((rank, doc))
+        else:
+            groups.setdefault(key, []).append((rank, doc))
+
+    for members in groups.values():
+        members.sort(key=lambda m: m[1].metadata["start_index"])
+        rank, doc = members[0]
+        start, text = doc.metadata["start_index"], doc.page_content
+        for next_rank, nxt in members[1:]:
+            next_start = nxt.metadata["start_index"]
+            end = start + len(text)
+            if next_start <= end:
+                text += nxt.page_content[end - next_start:]
+                rank = min(rank, next_rank)
+                continue
+            order.append((rank, Document(page_content=text, metadata={**doc.metadata, "start_index": start})))
+            rank, doc, start, text = next_rank, nxt, next_start, nxt.page_content
+        order.append((rank, Document(page_content=text, metadata={**doc.metadata, "start_index": start})))
+    return [doc for _, doc in sorted(order, key=lambda m: m[0])]
+
+
+def _without_embedding(doc: Document) -> Document:
+    if "embedding" not in doc.metadata:
+        return doc
+    return Document(page_content=doc.page_content, id=doc.id,
+                    metadata={key: v for key, v in doc.metadata.items() if key != "embedding"})
+
+
+class DiverseRetriever(BaseRetriever):
+    """Picks k of the base retriever's candidates with MMR, then merges adjacent chunks.
+
+    Candidate embeddings are the ones already stored with the chunks, from
+    stored_vectors(candidates); only chunks it has no vector for (None) are
+    re-encoded. Relevance blends query similarity with the candidates' rank,
+    so exact-token hits promoted by fusion are not lost to similarity alone.
+    """
+
+    base_retriever: BaseRetriever
+    embeddings: Embeddings
+    stored_vectors: Optional[Callable[[List[Document]], list]] = None
+    k: int = 5
+    lambda_mult: float = MMR_LAMBDA
+
+    def _candidate_vectors(self, candidates: List[Document]) -> np.ndarray:
+        vectors = self.stored_vectors(candidates) if self.stored_vectors else [None] * len(candidates)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            for i, v in zip(missing, self.embeddings.embed_documents([candidates[i].page_content for i in missing])):
+                vectors[i] = v
+        return np.asarray(vectors, dtype=np.float32)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: Optional[CallbackManagerForRetrieverRun] = None) -> List[Document]:
+        candidates = self.base_retriever.invoke(query)
+        if len(candidates) > self.k:
+            doc_vecs = self._candidate_vectors(candidates)
+            query_vec = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+            prior = 1 - np.arange(len(candidates), dtype=np.float32) / len(candidates)
+            candidates = [candidates[i] for i in mmr(query_vec, doc_vecs, self.k, self.lambda_mult, prior)]
+        return merge_spans([_without_embedding(d) for d in candidates])
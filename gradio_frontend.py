@@ -1,17 +1,41 @@
 import gradio as gr
 import requests
 import os
+import json
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 BACKEND_URL = "http://127.0.0.1:8000"  
+TIMEOUT = (3.05, 30)  # (connect, read) seconds
+STREAM_TIMEOUT = (3.05, 120)  # read timeout applies between streamed chunks
+UPLOAD_TIMEOUT = (3.05, 300)
+
+def make_session():
+    """Keep-alive connection pool to the backend.
+
+    Connection failures are retried for every request (nothing was sent yet);
+    read errors and 502/503/504 only for idempotent GETs.
+    """
+    retry = Retry(total=3, connect=3, read=2, status=2, backoff_factor=0.3,
+                  status_forcelist=(502, 503, 504), allowed_methods=frozenset({"GET"}),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+http = make_session()
 
 def get_threads():
     """Fetch all threads."""
-    res = requests.get(f"{BACKEND_URL}/threads")
+    res = http.get(f"{BACKEND_URL}/threads", timeout=TIMEOUT)
     return res.json()
 
 def create_thread():
     """Create a new thread and update dropdown."""
-    res = requests.post(f"{BACKEND_URL}/threads/new")
+    res = http.post(f"{BACKEND_URL}/threads/new", timeout=TIMEOUT)
     thread_id = res.json().get("thread_id")
     threads = get_threads()
     return gr.update(choices=threads, value=thread_id), f"✅ New thread created: {thread_id[:8]}"
@@ -19,7 +43,8 @@ def create_thread():
 def upload_pdf(file, thread_id):
     """Correct file upload via FastAPI for Python 3.10 + Gradio 4.x."""
     if not file:
-        return "⚠️ Please select a file to upload."
+        yield "⚠️ Please select a file to upload."
+        return
 
     try:
         # Handle Gradio file object or path
@@ -35,52 +60,109 @@ def upload_pdf(file, thread_id):
         with open(filepath, "rb") as f:
             files = {'file': (filename, f, 'application/pdf')}
             data = {'thread_id': thread_id}
-            res = requests.post(f"{BACKEND_URL}/upload", files=files, data=data)
-
-        return res.json().get("status", "❌ Upload failed.")
+            res = http.post(f"{BACKEND_URL}/upload", files=files, data=data, timeout=UPLOAD_TIMEOUT)
+
+        body = res.json()
+        job_id = body.get("job_id")
+        if not job_id:
+            yield body.get("status", "❌ Upload failed.")
+            return
+
+        # Poll the ingestion job until it finishes
+        while True:
+            job = http.get(f"{BACKEND_URL}/jobs/{job_id}", timeout=TIMEOUT).json()
+            progress = job.get("progress", {})
+            if job.get("status") == "done":
+                yield "✅ Document uploaded and processed successfully."
+                return
+            if job.get("status") == "failed":
+                yield f"❌ Upload failed: {job.get('error')}"
+                return
+            yield (f"⏳ Processing {filename}: {progress.get('parsed_pages', 0)} pages, "
+                   f"{progress.get('chunks', 0)} chunks, {progress.get('embedded', 0)} embedded, "
+                   f"{progress.get('stored', 0)} stored")
+            time.sleep(1)
 
     except Exception as e:
-        return f"❌ Upload failed: {str(e)}"
-        return f"❌ Upload failed: {str(e)}"
+        yield f"❌ Upload failed: {str(e)}"
+
+def chat_with_agent(message, chat_history, thread_id, synced):
+    """Send message to backend and render the answer as it streams in.
 
-def chat_with_agent(message, chat_history, thread_id):
-    """Send message to backend."""
+    synced is {"thread_id", "last_id"}: the newest turn shown in the chat
+    window, advanced to this turn once it completes.
+    """
     if not thread_id:
-        return "", chat_history, "⚠️ Please select a thread first."
-    res = requests.post(
-        f"{BACKEND_URL}/chat",
-        data={"query": message, "thread_id": thread_id}
-    )
-    response = res.json().get("response", "❌ Error from backend.")
-    # Convert chat_history (Gradio format) to list of dicts
-    history = []
-    for pair in chat_history:
-        if pair[0] is not None:
-            history.append({"role": "user", "content": pair[0]})
-        if pair[1] is not None:
-            history.append({"role": "assistant", "content": pair[1]})
-    # Add new messages
-    history.append({"role": "user", "content": message})
-    history.append({"role": "assistant", "content": response})
-    # Convert back to Gradio format
-    gradio_history = format_history_for_gradio(history)
-    return "", gradio_history, "✅ Response generated."
-
-def load_history(thread_id):
-    """Load chat history."""
+        yield "", chat_history, "⚠️ Please select a thread first.", synced
+        return
+    # Gradio already hands us [[user, assistant], ...]; just append the new pair
+    gradio_history = list(chat_history or [])
+    gradio_history.append([message, ""])
+    yield "", gradio_history, "⏳ Generating...", synced
+
+    response = ""
+    event = None
+    with http.post(
+        f"{BACKEND_URL}/chat/stream",
+        data={"query": message, "thread_id": thread_id},
+        stream=True,
+        timeout=STREAM_TIMEOUT
+    ) as res:
+        if res.status_code == 503:
+            yield "", gradio_history[:-1], f"⚠️ {res.json().get('error')}", synced
+            return
+        for line in res.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if event == "error":
+                    if data.get("busy"):
+                        yield "", gradio_history[:-1], f"⚠️ {data.get('error')}", synced
+                        return
+                    yield "", gradio_history, f"❌ Error from backend: {data.get('error')}", synced
+                    return
+                if event == "done":
+                    if synced and synced.get("thread_id") == thread_id and data.get("id"):
+                        synced = {"thread_id": thread_id, "last_id": data["id"]}
+                else:
+                    response += data.get("token", "")
+                    gradio_history[-1][1] = response
+                    yield "", gradio_history, "⏳ Generating...", synced
+            elif not line:
+                event = None
+    yield "", gradio_history, "✅ Response generated.", synced
+
+def load_history(thread_id, chat_history, synced):
+    """Load chat history, fetching only turns newer than the last one shown for this thread."""
     if not thread_id:
-        return [], "⚠️ Please select a thread first."
-    res = requests.get(f"{BACKEND_URL}/threads/{thread_id}/history")
-    history = res.json()
-    gradio_history = format_history_for_gradio(history)
-    return gradio_history, f"✅ History loaded for {thread_id[:8]}"
+        return [], "⚠️ Please select a thread first.", None
+    incremental = bool(synced and synced.get("thread_id") == thread_id)
+    after_id = synced.get("last_id") if incremental else None
+    history = []
+    last_id = after_id
+    while True:
+        params = {"after_id": after_id} if after_id else {}
+        res = http.get(f"{BACKEND_URL}/threads/{thread_id}/history", params=params, timeout=TIMEOUT)
+        res.raise_for_status()
+        page = res.json()
+        history.extend(page["messages"])
+        last_id = page.get("last_id") or last_id
+        after_id = page.get("next_after_id")
+        if not after_id:
+            break
+    new_pairs = format_history_for_gradio(history)
+    gradio_history = (list(chat_history or []) if incremental else []) + new_pairs
+    status = (f"✅ {len(new_pairs)} new messages for {thread_id[:8]}" if incremental
+              else f"✅ History loaded for {thread_id[:8]}")
+    return gradio_history, status, {"thread_id": thread_id, "last_id": last_id}
 
 def reset_thread(thread_id):
     """Clear chat history & document."""
     if not thread_id:
-        return "⚠️ Please select a thread.", [], None
-    requests.post(f"{BACKEND_URL}/threads/{thread_id}/reset")
-    return f"✅ Thread {thread_id[:8]} reset.", [], None
+        return "⚠️ Please select a thread.", [], None, None
+    http.post(f"{BACKEND_URL}/threads/{thread_id}/reset", timeout=TIMEOUT)
+    return f"✅ Thread {thread_id[:8]} reset.", [], None, {"thread_id": thread_id, "last_id": None}
 
 def format_history_for_gradio(history):
     """Convert [{'role', 'content'}] to [[user, assistant], ...] for Gradio Chatbot."""
@@ -117,6 +199,7 @@ with gr.Blocks(title="Gradio Frontend for FastAPI RAG Chatbot") as demo:
                 send_btn = gr.Button("Send", variant="primary", scale=1)
             reset_btn = gr.Button("🧹 Reset Thread", variant="secondary")
             chat_status = gr.Markdown()
+            history_sync = gr.State(None)  # {"thread_id", "last_id"} of what the chat window shows
 
     # Sync thread dropdowns on load
     def sync_threads():
@@ -141,20 +224,20 @@ with gr.Blocks(title="Gradio Frontend for FastAPI RAG Chatbot") as demo:
 
     load_history_btn.click(
         fn=load_history,
-        inputs=[thread_selector_chat],
-        outputs=[chatbot, chat_status],
+        inputs=[thread_selector_chat, chatbot, history_sync],
+        outputs=[chatbot, chat_status, history_sync],
     )
 
     send_btn.click(
         fn=chat_with_agent,
-        inputs=[message_input, chatbot, thread_selector_chat],
-        outputs=[message_input, chatbot, chat_status],
+        inputs=[message_input, chatbot, thread_selector_chat, history_sync],
+        outputs=[message_input, chatbot, chat_status, history_sync],
     )
 
     reset_btn.click(
         fn=reset_thread,
         inputs=[thread_selector_chat],
-        outputs=[chat_status, chatbot, message_input],
+        outputs=[chat_status, chatbot, message_input, history_sync],
     )
 
 demo.launch()
@@ -0,0 +1,189 @@
+import os
+import time
+import uuid
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import telemetry
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "32"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+JOB_SAVE_INTERVAL_SECONDS = float(os.getenv("JOB_SAVE_INTERVAL_SECONDS", "1"))  # progress writes per job
+
+STAGES = ("parsed_pages", "chunks", "embedded", "stored", "reused")
+
+
+class QueueFull(Exception):
+    pass
+
+
+class IngestJob:
+    def __init__(self, user_id: str, thread_id: str, document_name: str, content_hash: str):
+        self.id = uuid.uuid4().hex
+        self.content_hash = content_hash
+        self.user_id = user_id
+        self.thread_id = thread_id
+        self.document_name = document_name
+        self.status = "queued"
+        self.progress = {stage: 0 for stage in STAGES}
+        self.error = None
+        self.request_id = telemetry.current_request_id()  # the upload request, for log correlation
+        self.created_at = time.time()
+        self.finished_at = None
+        self.saved_at = 0.0
+
+    @property
+    def thread(self) -> tuple:
+        return self.user_id, self.thread_id
+
+    def update(self, stage: str, count: int):
+        """Progress callback handed to the ingestion pipeline."""
+        self.progress[stage] = count
+
+    def record(self) -> dict:
+        """The job as stored in the ingest_jobs collection; expire_at drives its TTL index."""
+        expire_at = datetime.fromtimestamp(self.finished_at, timezone.utc) if self.finished_at else None
+        return {
+            "_id": self.id,
+            "user_id": self.user_id,
+            "thread_id": self.thread_id,
+            "document_name": self.document_name,
+            "status": self.status,
+            "progress": dict(self.progress),
+            "error": self.error,
+            "request_id": self.request_id,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "expire_at": expire_at,
+        }
+
+    def to_dict(self) -> dict:
+        return job_view(self.record())
+
+
+def job_view(record: dict) -> dict:
+    """What GET /jobs/{job_id} returns for a stored job record."""
+    return {
+        "job_id": record["_id"],
+        "thread_id": record["thread_id"],
+        "document_name": record["document_name"],
+        "status": record["status"],
+        "progress": dict(record["progress"]),
+        "error": record["error"],
+        "elapsed": round((record["finished_at"] or time.time()) - record["created_at"], 3),
+    }
+
+
+class IngestQueue:
+    """Runs uploads on a bounded worker pool, at most one per thread.
+
+    An upload to a thread that is already ingesting waits for that job and
+    supersedes any upload still waiting before it, since only the newest
+    document is kept. Re-uploading the newest document returns its job.
+    Job records and progress are saved through jobs(), a callable returning
+    the ingest_jobs collection, so any uvicorn worker can report a job;
+    unfinished jobs are answered from memory by the worker running them.
+    """
+
+    def __init__(self, run, jobs, workers: int = INGEST_WORKERS, max_pending: int = INGEST_MAX_PENDING):
+        self.run = run
+        self.jobs = jobs
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self._jobs = {}  # unfinished jobs of this process, by id
+        self._active = {}   # (user_id, thread_id) -> running or queued job
+        self._waiting = {}  # (user_id, thread_id) -> (job, path) to start once the active one ends
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def submit(self, path: str, user_id: str, thread_id: str, document_name: str, content_hash: str):
+        """Queue an upload; returns (job, coalesced). The worker deletes path when done."""
+        thread = (user_id, thread_id)
+        superseded = None
+        with self._lock:
+            active = self._active.get(thread)
+            waiting = self._waiting.get(thread)
+            newest = waiting[0] if waiting else active
+            if newest is not None and newest.content_hash == content_hash:
+                return newest, True
+            if waiting is None and len(self._active) + len(self._waiting) >= self.max_pending:
+                raise QueueFull()
+            job = IngestJob(user_id, thread_id, document_name, content_hash)
+            self._jobs[job.id] = job
+            if active is None:
+                self._active[thread] = job
+            else:
+                superseded = waiting
+                self._waiting[thread] = (job, path)
+        self._save(job)
+        if superseded is not None:
+            self._finish(*superseded, status="superseded")
+        if active is None:
+            self._pool.submit(self._work, job, path)
+        return job, False
+
+    def _work(self, job: IngestJob, path: str):
+        job.status = "running"
+        self._save(job)
+
+        def progress(stage: str, count: int):
+            job.update(stage, count)
+            if time.time() - job.saved_at >= JOB_SAVE_INTERVAL_SECONDS:
+                self._save(job)
+
+        try:
+            with telemetry.trace("ingest", request_id=job.request_id, thread_id=job.thread_id, job_id=job.id):
+                self.run(path, user_id=job.user_id, thread_id=job.thread_id,
+                         document_name=job.document_name, progress=progress)
+            job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            print(f"[ERROR] Ingestion job {job.id} failed: {e}")
+        finally:
+            self._finish(job, path)
+            with self._lock:
+                following = self._waiting.pop(job.thread, None)
+                if following is None:
+                    self._active.pop(job.thread, None)
+                    self._idle.notify_all()
+                else:
+                    self._active[job.thread] = following[0]
+            if following is not None:
+                self._pool.submit(self._work, *following)
+
+    def _finish(self, job: IngestJob, path: str, status: str = None):
+        if status:
+            job.status = status
+        job.finished_at = time.time()
+        if self._save(job):
+            with self._lock:
+                self._jobs.pop(job.id, None)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _save(self, job: IngestJob) -> bool:
+        """Write the job's record; on failure the previous record stays until the next save."""
+        job.saved_at = time.time()
+        try:
+            self.jobs().replace_one({"_id": job.id}, job.record(), upsert=True)
+            return True
+        except Exception as e:
+            print(f"[WARN] Could not save ingestion job {job.id}: {e}")
+            return False
+
+    def get(self, job_id: str):
+        """A job's status and progress: live while it runs in this process, else from its record."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        record = self.jobs().find_one({"_id": job_id})
+        return job_view(record) if record else None
+
+    def shutdown(self):
+        # Uploads waiting behind a running job are only submitted when it ends
+        with self._idle:
+            self._idle.wait_for(lambda: not self._active)
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,86 @@
+import time
+import threading
+import functools
+
+WARM_UP_RETRY_SECONDS = 10
+
+
+class Lazy:
+    """Value built by factory on first call, once, thread-safely.
+
+    A failed build is not cached, so the next call tries again.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._value = None
+        self._built = False
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self._value = self.factory()
+                    self._built = True
+        return self._value
+
+    @property
+    def built(self) -> bool:
+        return self._built
+
+    def peek(self):
+        """The value if it has been built, else None (never builds)."""
+        return self._value if self._built else None
+
+
+def lazy(factory):
+    """Decorator turning a zero-argument factory into a Lazy getter."""
+    return functools.update_wrapper(Lazy(factory), factory)
+
+
+class WarmUp:
+    """Runs named warm-up steps on a background thread and reports their status.
+
+    Steps that fail are retried on a later start(), at most every
+    WARM_UP_RETRY_SECONDS. Optional steps (services the app can run without,
+    like web search) are reported but do not hold back readiness.
+    """
+
+    def __init__(self, steps: dict, optional=()):
+        self.steps = steps
+        self.optional = set(optional)
+        self.state = {name: "pending" for name in steps}
+        self._thread = None
+        self._finished_at = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self.ready or (self._finished_at and time.time() - self._finished_at < WARM_UP_RETRY_SECONDS):
+                return
+            self._thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+            self._thread.start()
+
+    def run(self):
+        for name, step in self.steps.items():
+            if self.state[name] == "ready":
+                continue
+            start = time.perf_counter()
+            try:
+                step()
+                self.state[name] = "ready"
+                print(f"[INFO] Warmed up {name} in {time.perf_counter() - start:.2f}s")
+            except Exception as e:
+                self.state[name] = f"failed: {e}"
+                print(f"[WARN] Warm-up of {name} failed: {e}")
+        self._finished_at = time.time()
+
+    @property
+    def ready(self) -> bool:
+        return all(s == "ready" for name, s in self.state.items() if name not in self.optional)
+
+    def status(self) -> dict:
+        return {"ready": self.ready, "components": dict(self.state), "optional": sorted(self.optional)}
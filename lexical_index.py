@@ -0,0 +1,301 @@
+import os
+import re
+import json
+import math
+import glob
+import shutil
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+import numpy as np
+import xxhash
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "lexical_index")
+LEXICAL_CACHE_SIZE = int(os.getenv("LEXICAL_CACHE_SIZE", "64"))
+MAX_SEGMENTS = 8
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+# Keeps tickers, fiscal years, form names and figures intact: "fy2023", "10-k", "3.5", "ebitda"
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were what when "
+    "which who will with how did does do".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def namespace(user_id, thread_id) -> str:
+    return xxhash.xxh64_hexdigest(f"{user_id}\0{thread_id}".encode("utf-8"))
+
+
+class LexicalIndex:
+    """BM25 inverted index over one thread's chunks.
+
+    Each add() writes an immutable compressed segment (sorted terms plus
+    uint32 doc ids and uint16 term frequencies), so updates are incremental;
+    segments are merged once there are more than MAX_SEGMENTS. Loading reads
+    only the segments that appeared since the last load.
+    """
+
+    def __init__(self, path: str, lock=None):
+        self.path = path
+        self._lock = lock or threading.Lock()
+        self._loaded_state = None
+        self.docs = []
+        self.doc_lens = np.zeros(0, dtype=np.uint32)
+        self.postings = {}  # term -> (doc ids, term frequencies)
+
+    def _segments(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.path, "seg_*.npz")))
+
+    def _state(self):
+        """Files on disk, used to notice segments written by other processes."""
+        return tuple(self._segments())
+
+    def _load(self):
+        state = self._state()
+        if state == self._loaded_state:
+            return
+        loaded = self._loaded_state
+        if loaded is not None and state[:len(loaded)] == loaded:
+            # Only new segments were added: extend what is already in memory
+            docs, lens, postings, new = list(self.docs), [self.doc_lens], dict(self.postings), state[len(loaded):]
+        else:
+            docs, lens, postings, new = [], [], {}, state
+        parts = {}  # term -> [(doc ids, term frequencies)] from the new segments
+        for seg in new:
+            # Each npz member is decompressed on access, so read every array once
+            data = np.load(seg)
+            offsets = data["offsets"].tolist()
+            doc_ids = data["doc_ids"].astype(np.uint32) + len(docs)
+            tfs = data["tfs"]
+            terms = json.loads(bytes(data["terms"]).decode("utf-8"))
+            lens.append(data["doc_lens"])
+            with open(seg[:-4] + ".jsonl", encoding="utf-8") as f:
+                docs.extend(json.loads(line) for line in f if line.strip())
+            for i, term in enumerate(terms):
+                parts.setdefault(term, []).append((doc_ids[offsets[i]:offsets[i + 1]], tfs[offsets[i]:offsets[i + 1]]))
+        for term, chunks in parts.items():
+            if term in postings:
+                chunks.insert(0, postings[term])
+            postings[term] = chunks[0] if len(chunks) == 1 else (np.concatenate([c[0] for c in chunks]),
+                                                                 np.concatenate([c[1] for c in chunks]))
+        self.docs = docs
+        self.doc_lens = np.concatenate(lens) if lens else np.zeros(0, dtype=np.uint32)
+        self.postings = postings
+        self._loaded_state = state
+
+    def _write_segment(self, name: str, docs: List[dict]):
+        term_docs = {}
+        lens = np.zeros(len(docs), dtype=np.uint32)
+        for i, doc in enumerate(docs):
+            counts = Counter(tokenize(doc["text"]))
+            lens[i] = sum(counts.values())
+            for term, tf in counts.items():
+                term_docs.setdefault(term, []).append((i, min(tf, 65535)))
+        terms = sorted(term_docs)
+        offsets = np.zeros(len(terms) + 1, dtype=np.uint32)
+        doc_ids, tfs = [], []
+        for i, term in enumerate(terms):
+            entries = term_docs[term]
+            offsets[i + 1] = offsets[i] + len(entries)
+            doc_ids.extend(e[0] for e in entries)
+            tfs.extend(e[1] for e in entries)
+        os.makedirs(self.path, exist_ok=True)
+        base = os.path.join(self.path, name)
+        with open(base + ".jsonl.tmp", "w", encoding="utf-8") as f:
+            for doc in docs:
+                f.write(json.dumps(doc) + "\n")
+        np.savez_compressed(
+            base + ".tmp.npz",
+            terms=np.frombuffer(json.dumps(terms).encode("utf-8"), dtype=np.uint8),
+            offsets=offsets,
+            doc_ids=np.asarray(doc_ids, dtype=np.uint32),
+            tfs=np.asarray(tfs, dtype=np.uint16),
+            doc_lens=lens,
+        )
+        # Docs first, then the segment, so readers never see a segment without its docs
+        os.replace(base + ".jsonl.tmp", base + ".jsonl")
+        os.replace(base + ".tmp.npz", base + ".npz")
+
+    def add(self, texts: List[str], metadatas: List[dict]):
+        """Index new chunks as a new segment."""
+        if not texts:
+            return
+        with self._lock:
+            segments = self._segments()
+            seq = int(os.path.basename(segments[-1])[4:-4]) + 1 if segments else 0
+            self._write_segment(f"seg_{seq:06d}", [{"text": t, "metadata": m} for t, m in zip(texts, metadatas)])
+            if len(segments) + 1 > MAX_SEGMENTS:
+                self._merge()
+
+    def _merge(self):
+        """Rewrite all segments as one."""
+        self._load()
+        segments = self._segments()
+        seq = int(os.path.basename(segments[-1])[4:-4]) + 1
+        self._write_segment(f"seg_{seq:06d}", self.docs)
+        for seg in segments:
+            os.remove(seg)
+            os.remove(seg[:-4] + ".jsonl")
+
+    def rewrite(self, keep):
+        """Keep only the docs for which keep(doc) is true."""
+        with self._lock:
+            self._load()
+            docs = [d for d in self.docs if keep(d)]
+            segments = self._segments()
+            if len(docs) == len(self.docs):
+                return
+            seq = int(os.path.basename(segments[-1])[4:-4]) + 1 if segments else 0
+            if docs:
+                self._write_segment(f"seg_{seq:06d}", docs)
+            for seg in segments:
+                os.remove(seg)
+                os.remove(seg[:-4] + ".jsonl")
+
+    def search(self, query: str, k: int) -> List[Document]:
+        """Top-k chunks by BM25."""
+        with self._lock:
+            self._load()
+            n = len(self.docs)
+            if not n:
+                return []
+            scores = np.zeros(n, dtype=np.float32)
+            avg_len = float(self.doc_lens.mean()) or 1.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lens / avg_len)
+            for term in set(tokenize(query)):
+                if term not in self.postings:
+                    continue
+                ids, tfs = self.postings[term]
+                idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+                tf = tfs.astype(np.float32)
+                scores[ids] += idf * tf * (BM25_K1 + 1) / (tf + norm[ids])
+            hits = np.flatnonzero(scores)
+            if not len(hits):
+                return []
+            top = hits[np.argsort(-scores[hits])[:k]]
+            return [Document(page_content=self.docs[i]["text"], metadata=self.docs[i]["metadata"]) for i in top]
+
+
+class LexicalStore:
+    """Per-thread lexical indexes persisted under path, with recently used ones kept loaded.
+
+    Callers should look indexes up through index() on every use rather than
+    hold on to them, so the LRU bounds what stays loaded. Every instance for a
+    directory shares one lock, so an evicted instance still in use cannot
+    rewrite segments while a newer one reads them.
+    """
+
+    def __init__(self, path: str = LEXICAL_INDEX_DIR, max_loaded: int = LEXICAL_CACHE_SIZE):
+        self.path = path
+        self.max_loaded = max_loaded
+        self._indexes = OrderedDict()
+        self._dir_locks = {}  # namespace -> lock, kept after eviction
+        self._lock = threading.Lock()
+
+    def index(self, user_id: str, thread_id: str) -> LexicalIndex:
+        key = namespace(user_id, thread_id)
+        with self._lock:
+            if key not in self._indexes:
+                lock = self._dir_locks.setdefault(key, threading.Lock())
+                self._indexes[key] = LexicalIndex(os.path.join(self.path, key), lock)
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_loaded:
+                self._indexes.popitem(last=False)
+            return self._indexes[key]
+
+    def add(self, user_id: str, thread_id: str, texts: List[str], metadatas: List[dict]):
+        self.index(user_id, thread_id).add(texts, metadatas)
+
+    def copy(self, source: dict, owner: dict, doc_hash: str):
+        """Index a document's chunks from another thread under new owner tags."""
+        src = self.index(source["user_id"], source["thread_id"])
+        with src._lock:
+            src._load()
+            docs = [d for d in src.docs if d["metadata"].get("doc_hash") == doc_hash]
+        self.add(owner["user_id"], owner["thread_id"], [d["text"] for d in docs],
+                 [{**d["metadata"], **owner} for d in docs])
+
+    def _remove(self, key: str):
+        with self._lock:
+            self._indexes.pop(key, None)
+            lock = self._dir_locks.setdefault(key, threading.Lock())
+        with lock:
+            shutil.rmtree(os.path.join(self.path, key), ignore_errors=True)
+
+    def delete(self, user_id: str, thread_id: str):
+        self._remove(namespace(user_id, thread_id))
+
+    def keep_document(self, user_id: str, thread_id: str, doc_hash: str):
+        """Drop a thread's chunks from any other document version."""
+        self.index(user_id, thread_id).rewrite(lambda d: d["metadata"].get("doc_hash") == doc_hash)
+
+    def compact(self, live: dict, active=()) -> int:
+        """Delete the indexes of threads without a live document, and stale versions from the rest.
+
+        live maps (user_id, thread_id) to the thread's doc_hash; threads in
+        active are being ingested and left alone. Returns the indexes deleted.
+        """
+        keep = {namespace(*owner) for owner, doc_hash in live.items() if doc_hash}
+        keep |= {namespace(*owner) for owner in active}
+        names = os.listdir(self.path) if os.path.isdir(self.path) else []
+        removed = 0
+        for name in names:
+            if name not in keep:
+                self._remove(name)
+                removed += 1
+        for (user_id, thread_id), doc_hash in live.items():
+            if doc_hash and (user_id, thread_id) not in active and namespace(user_id, thread_id) in names:
+                self.keep_document(user_id, thread_id, doc_hash)
+        return removed
+
+
+_fusion_pool = ThreadPoolExecutor(max_workers=int(os.getenv("HYBRID_WORKERS", "8")), thread_name_prefix="hybrid")
+
+
+def _doc_key(doc: Document):
+    return doc.metadata.get("chunk_hash") or doc.page_content
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int, rrf_k: int = RRF_K) -> List[Document]:
+    """Fuse ranked lists by summing 1 / (rrf_k + rank)."""
+    scores, docs = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = _doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)[:k]]
+
+
+class HybridRetriever(BaseRetriever):
+    """Runs vector and BM25 retrieval in parallel and fuses them with reciprocal rank fusion.
+
+    The thread's lexical index is looked up in the store on every search, so
+    it can be evicted while this retriever stays cached.
+    """
+
+    vector_retriever: BaseRetriever
+    lexical_store: LexicalStore
+    user_id: str
+    thread_id: str
+    k: int = 5
+    fetch_k: int = 20
+
+    def _search_lexical(self, query: str) -> List[Document]:
+        return self.lexical_store.index(self.user_id, self.thread_id).search(query, self.fetch_k)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: Optional[CallbackManagerForRetrieverRun] = None) -> List[Document]:
+        lexical = _fusion_pool.submit(self._search_lexical, query)
+        vector_docs = self.vector_retriever.invoke(query)
+        return reciprocal_rank_fusion([vector_docs, lexical.result()], self.k)
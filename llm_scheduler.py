@@ -0,0 +1,294 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from tenacity import Retrying, AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+from context_packer import count_tokens
+from telemetry import record, register, Counter, Gauge
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_MAX_WAIT_SECONDS = float(os.getenv("LLM_MAX_WAIT_SECONDS", "20"))
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))  # 0 disables the limit
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+LLM_COMPLETION_TOKENS = int(os.getenv("LLM_COMPLETION_TOKENS", "512"))  # reserved per call until usage is known
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "4"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+RETRY_STATUS = (429, 503)
+
+shed_total = register(Counter("rag_llm_shed_total", "LLM calls refused with a busy response.", ("reason",)))
+retries_total = register(Counter("rag_llm_retries_total", "LLM calls retried after a rate limit or overload."))
+
+
+class Busy(Exception):
+    """The LLM queue is too deep to wait in; callers should answer "busy" right away."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("The assistant is busy right now, please try again in a few seconds.")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Refills at per_minute / 60 per second up to per_minute; reservations may overdraw it."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until amount would be covered, without taking it."""
+        with self._lock:
+            self._refill()
+            return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float) -> float:
+        """Reserve amount; returns the seconds to wait before using it."""
+        with self._lock:
+            self._refill()
+            self.level -= min(amount, self.capacity)
+            return max(0.0, -self.level / self.rate)
+
+    def give(self, amount: float):
+        """Return part of a reservation (negative to take more, e.g. when usage beat the estimate)."""
+        with self._lock:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class _Waiter:
+    __slots__ = ("granted", "wake")
+
+    def __init__(self, wake):
+        self.granted = False
+        self.wake = wake
+
+
+class Slots:
+    """Concurrency limit shared by threads and coroutines, granted in arrival order."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.free = limit
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def in_use(self) -> int:
+        return self.limit - self.free
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _enqueue(self, wake):
+        """Take a slot now (returns None) or queue a waiter for one."""
+        with self._lock:
+            if self.free and not self._waiters:
+                self.free -= 1
+                return None
+            waiter = _Waiter(wake)
+            self._waiters.append(waiter)
+            return waiter
+
+    def _abandon(self, waiter) -> bool:
+        """Leave the queue after a timeout; True if the slot was granted meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def acquire(self, timeout: float) -> bool:
+        event = threading.Event()
+        waiter = self._enqueue(event.set)
+        if waiter is None or event.wait(timeout):
+            return True
+        return self._abandon(waiter)
+
+    async def aacquire(self, timeout: float) -> bool:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+        waiter = self._enqueue(wake)
+        if waiter is None:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self._abandon(waiter)
+        except asyncio.CancelledError:
+            if self._abandon(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+            else:
+                self.free += 1
+                return
+        waiter.wake()
+
+
+def _retryable(e: BaseException) -> bool:
+    return getattr(e, "status_code", None) in RETRY_STATUS
+
+
+def _retry_after(e: BaseException) -> float:
+    response = getattr(e, "response", None)
+    try:
+        return float(response.headers.get("retry-after", 0)) if response is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class LLMScheduler:
+    """Admission control in front of the LLM client.
+
+    Each call first reserves one request and its estimated tokens from the
+    per-minute buckets, then waits for one of max_concurrency slots. Callers
+    that would queue behind max_queue others, or wait longer than max_wait,
+    get Busy immediately instead, and anything they reserved is given back.
+    Calls that fail with 429/503 are retried with jittered exponential
+    backoff, honouring Retry-After; every retry reserves another request.
+    A rejected attempt used no tokens, so the token reservation carries over.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, rpm: float = LLM_RPM, tpm: float = LLM_TPM,
+                 max_queue: int = LLM_MAX_QUEUE, max_wait: float = LLM_MAX_WAIT_SECONDS, retries: int = LLM_RETRIES):
+        self.slots = Slots(max_concurrency)
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.retries = retries
+        self.throttled = 0  # callers sleeping on the rate limits
+        self._throttled_lock = threading.Lock()
+
+    def queue_depth(self) -> int:
+        return self.slots.waiting + self.throttled
+
+    def overloaded(self) -> bool:
+        """Whether a new call would be shed right now."""
+        return self.queue_depth() >= self.max_queue
+
+    def _throttle(self, delta: int):
+        with self._throttled_lock:
+            self.throttled += delta
+
+    def _busy(self, reason: str, retry_after: float) -> Busy:
+        shed_total.inc(reason)
+        return Busy(retry_after)
+
+    def _buckets(self, requests: int, tokens: int) -> list:
+        return [(b, n) for b, n in ((self.requests, requests), (self.tokens, tokens)) if b is not None and n]
+
+    def _reserve(self, tokens: int) -> float:
+        """Check the queue and buckets; returns the rate-limit delay, or raises Busy."""
+        if self.overloaded():
+            raise self._busy("queue", 1.0)
+        buckets = self._buckets(1, tokens)
+        delay = max([b.delay(n) for b, n in buckets], default=0.0)
+        if delay > self.max_wait:
+            raise self._busy("rate_limit", delay)
+        return max([b.take(n) for b, n in buckets], default=0.0)
+
+    def _refund(self, tokens: int):
+        """Give back a reservation for a call that never ran."""
+        for bucket, n in self._buckets(1, tokens):
+            bucket.give(n)
+
+    def settle(self, estimated: int, used: int):
+        """Correct the token bucket once the call reports its real usage."""
+        if self.tokens is not None and used:
+            self.tokens.give(estimated - used)
+
+    @staticmethod
+    def estimate(prompt: str) -> int:
+        return count_tokens(prompt) + LLM_COMPLETION_TOKENS
+
+    @contextmanager
+    def admitted(self, tokens: int):
+        """Hold an LLM slot for the block, after the rate limits allow it."""
+        start = time.perf_counter()
+        delay = self._reserve(tokens)
+        try:
+            if delay:
+                self._throttle(1)
+                try:
+                    time.sleep(delay)
+                finally:
+                    self._throttle(-1)
+            if not self.slots.acquire(max(0.0, self.max_wait - delay)):
+                raise self._busy("timeout", 1.0)
+        except BaseException:
+            self._refund(tokens)
+            raise
+        record("llm_queue", time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            self.slots.release()
+
+    @asynccontextmanager
+    async def aadmitted(self, tokens: int):
+        """Async admitted()."""
+        start = time.perf_counter()
+        delay = self._reserve(tokens)
+        try:
+            if delay:
+                self._throttle(1)
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self._throttle(-1)
+            if not await self.slots.aacquire(max(0.0, self.max_wait - delay)):
+                raise self._busy("timeout", 1.0)
+        except BaseException:
+            self._refund(tokens)
+            raise
+        record("llm_queue", time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            self.slots.release()
+
+    def _retry_kwargs(self) -> dict:
+        backoff = wait_random_exponential(multiplier=0.5, max=20)
+
+        def wait(retry_state):
+            retries_total.inc()
+            # The retry is another request against the per-minute limit
+            paced = max([b.take(n) for b, n in self._buckets(1, 0)], default=0.0)
+            return max(backoff(retry_state), _retry_after(retry_state.outcome.exception()), paced)
+        return {"retry": retry_if_exception(_retryable), "stop": stop_after_attempt(self.retries + 1),
+                "wait": wait, "reraise": True}
+
+    def call(self, fn):
+        """Run fn(), retrying rate-limit and overload errors."""
+        return Retrying(**self._retry_kwargs())(fn)
+
+    async def acall(self, fn):
+        """Await fn(), retrying rate-limit and overload errors."""
+        async def attempt():
+            return await fn()
+        return await AsyncRetrying(**self._retry_kwargs())(attempt)
+
+
+scheduler = LLMScheduler()
+register(Gauge("rag_llm_queue_depth", "LLM calls waiting for a slot or the rate limit.", scheduler.queue_depth))
+register(Gauge("rag_llm_in_flight", "LLM calls running.", lambda: scheduler.slots.in_use))
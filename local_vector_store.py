@@ -0,0 +1,482 @@
+import os
+import json
+import uuid
+import shutil
+import threading
+from typing import Any, Iterable, List, Optional, Tuple
+import numpy as np
+import xxhash
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "vector_index")
+IVF_MIN_VECTORS = int(os.getenv("IVF_MIN_VECTORS", "20000"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+IVF_TRAIN_ITERS = int(os.getenv("IVF_TRAIN_ITERS", "10"))
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")  # "none", "int8" or "float16"
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", "4"))
+QUANTIZED_DTYPES = {"int8": np.int8, "float16": np.float16}
+BLOCK_ROWS = 65536
+
+
+def _match(metadata: dict, pre_filter: Optional[dict]) -> bool:
+    """Evaluate the subset of Atlas filter syntax used here ($and, $eq, $in, $ne, plain equality)."""
+    if not pre_filter:
+        return True
+    for key, cond in pre_filter.items():
+        if key == "$and":
+            if not all(_match(metadata, c) for c in cond):
+                return False
+            continue
+        value = metadata.get(key)
+        if isinstance(cond, dict):
+            if "$eq" in cond and value != cond["$eq"]:
+                return False
+            if "$ne" in cond and value == cond["$ne"]:
+                return False
+            if "$in" in cond and value not in cond["$in"]:
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+def _equals(pre_filter: Optional[dict], key: str):
+    """Pull a plain equality value for key out of a filter, if there is one."""
+    if not pre_filter:
+        return None
+    cond = pre_filter.get(key)
+    if isinstance(cond, dict):
+        return cond.get("$eq")
+    if cond is not None:
+        return cond
+    for sub in pre_filter.get("$and", []):
+        found = _equals(sub, key)
+        if found is not None:
+            return found
+    return None
+
+
+def quantize(vectors: np.ndarray, mode: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Codes for unit vectors, plus per-row scales for int8 (code * scale ~ value)."""
+    if mode == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def shard_name(user_id, thread_id) -> str:
+    return xxhash.xxh64_hexdigest(f"{user_id}\0{thread_id}".encode("utf-8"))
+
+
+class Shard:
+    """Vectors of one (user_id, thread_id) namespace in append-only memory-mapped files.
+
+    Callers hold lock around every read and write, so shards are searched
+    and written independently of each other.
+    """
+
+    def __init__(self, path: str, quantization: str = "none"):
+        if quantization != "none" and quantization not in QUANTIZED_DTYPES:
+            raise ValueError(f"Unknown VECTOR_QUANTIZATION: {quantization}")
+        self.path = path
+        self.quantization = None if quantization == "none" else quantization
+        self.dim = None
+        self.docs = []
+        self.lock = threading.RLock()
+        self._vectors = None
+        self._quantized = None
+        self._ivf = None
+        self._recover()
+        if os.path.exists(self._docs_path):
+            with open(self._docs_path, encoding="utf-8") as f:
+                self.docs = [json.loads(line) for line in f if line.strip()]
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                self.dim = json.load(f)["dim"]
+
+    @property
+    def _rewrite_path(self):
+        return self.path + ".rewrite"
+
+    @property
+    def _old_path(self):
+        return self.path + ".old"
+
+    def _recover(self):
+        """Finish or undo a rewrite() interrupted by a crash.
+
+        The rewritten copy is complete before the old directory is moved
+        aside, so it is kept only if the old one was already gone.
+        """
+        if os.path.isdir(self._rewrite_path):
+            if os.path.exists(self.path):
+                shutil.rmtree(self._rewrite_path, ignore_errors=True)
+            else:
+                os.rename(self._rewrite_path, self.path)
+        if os.path.isdir(self._old_path):
+            shutil.rmtree(self._old_path, ignore_errors=True)
+
+    @property
+    def _docs_path(self):
+        return os.path.join(self.path, "docs.jsonl")
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.path, "vectors.f32")
+
+    @property
+    def _codes_path(self):
+        return os.path.join(self.path, f"vectors.{self.quantization}")
+
+    @property
+    def _scales_path(self):
+        return os.path.join(self.path, "scales.f32")
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.path, "meta.json")
+
+    @property
+    def _ivf_path(self):
+        return os.path.join(self.path, "ivf.npz")
+
+    def __len__(self):
+        return len(self.docs)
+
+    def vectors(self) -> np.ndarray:
+        """Memory-mapped (n, dim) float32 matrix of unit vectors."""
+        if self._vectors is None or len(self._vectors) != len(self.docs):
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r",
+                                      shape=(len(self.docs), self.dim)) if self.docs else np.zeros((0, self.dim or 0), np.float32)
+        return self._vectors
+
+    def _quantized_rows(self) -> int:
+        """Rows in the quantized files on disk, or -1 when they are missing or torn."""
+        if not os.path.exists(self._codes_path):
+            return -1
+        row_bytes = self.dim * np.dtype(QUANTIZED_DTYPES[self.quantization]).itemsize
+        rows, rest = divmod(os.path.getsize(self._codes_path), row_bytes)
+        if rest or (self.quantization == "int8" and (not os.path.exists(self._scales_path)
+                                                    or os.path.getsize(self._scales_path) != rows * 4)):
+            return -1
+        return rows
+
+    def _write_quantized(self, vectors: np.ndarray, mode: str = "ab"):
+        codes, scales = quantize(np.asarray(vectors, dtype=np.float32), self.quantization)
+        with open(self._codes_path, mode) as f:
+            f.write(codes.tobytes())
+        if scales is not None:
+            with open(self._scales_path, mode) as f:
+                f.write(scales.tobytes())
+
+    def quantized(self) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Memory-mapped quantized codes (and int8 row scales), rebuilt from float32 if out of step."""
+        n = len(self.docs)
+        if self._quantized is not None and len(self._quantized[0]) == n:
+            return self._quantized
+        if self._quantized_rows() != n:
+            mat = self.vectors()
+            for path in (self._codes_path, self._scales_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            for start in range(0, n, BLOCK_ROWS):
+                self._write_quantized(mat[start:start + BLOCK_ROWS])
+        codes = np.memmap(self._codes_path, dtype=QUANTIZED_DTYPES[self.quantization], mode="r", shape=(n, self.dim))
+        scales = (np.memmap(self._scales_path, dtype=np.float32, mode="r", shape=(n,))
+                  if self.quantization == "int8" else None)
+        self._quantized = (codes, scales)
+        return self._quantized
+
+    def append(self, vectors: np.ndarray, docs: List[dict]):
+        os.makedirs(self.path, exist_ok=True)
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+            with open(self._meta_path, "w") as f:
+                json.dump({"dim": self.dim}, f)
+        # Appended only while in step with the float32 file; otherwise quantized() rebuilds them
+        if self.quantization:
+            rows = self._quantized_rows()
+            if rows == len(self.docs) or (rows == -1 and not self.docs):
+                self._write_quantized(vectors)
+        with open(self._vectors_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self._docs_path, "a", encoding="utf-8") as f:
+            for doc in docs:
+                f.write(json.dumps(doc) + "\n")
+        self.docs.extend(docs)
+        self._vectors = None
+        self._quantized = None
+
+    def save_docs(self):
+        """Rewrite the records file after metadata changes (vectors are untouched)."""
+        tmp = self._docs_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for doc in self.docs:
+                f.write(json.dumps(doc) + "\n")
+        os.replace(tmp, self._docs_path)
+
+    def rewrite(self, keep: List[int]):
+        """Compact the shard down to the given row positions.
+
+        The kept rows are written to a sibling directory that is renamed into
+        place, so a crash leaves either the old shard or the new one.
+        """
+        docs = [self.docs[i] for i in keep]
+        shutil.rmtree(self._rewrite_path, ignore_errors=True)
+        if docs:
+            Shard(self._rewrite_path, self.quantization or "none").append(np.array(self.vectors()[keep]), docs)
+        self._vectors = None
+        self._quantized = None
+        self._ivf = None
+        if os.path.exists(self.path):
+            os.rename(self.path, self._old_path)
+        if docs:
+            os.rename(self._rewrite_path, self.path)
+        shutil.rmtree(self._old_path, ignore_errors=True)
+        self.docs = docs
+        if not docs:
+            self.dim = None
+
+    def _load_ivf(self):
+        if self._ivf is None and os.path.exists(self._ivf_path):
+            data = np.load(self._ivf_path)
+            self._ivf = (data["centroids"], data["assign"])
+        return self._ivf
+
+    def _build_ivf(self):
+        """Train coarse centroids with a few rounds of spherical k-means and persist the assignment."""
+        mat = self.vectors()
+        n = len(mat)
+        nlist = max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(0)
+        sample = mat[rng.choice(n, size=min(n, nlist * 64), replace=False)]
+        centroids = np.array(sample[rng.choice(len(sample), size=nlist, replace=False)])
+        for _ in range(IVF_TRAIN_ITERS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[labels == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+        assign = np.empty(n, dtype=np.int32)
+        for start in range(0, n, 65536):
+            assign[start:start + 65536] = np.argmax(mat[start:start + 65536] @ centroids.T, axis=1)
+        np.savez(self._ivf_path, centroids=centroids, assign=assign)
+        self._ivf = (centroids, assign)
+
+    def candidates(self, q: np.ndarray, nprobe: int) -> Optional[np.ndarray]:
+        """Row positions to score with IVF, or None for an exact scan."""
+        n = len(self.docs)
+        if n < IVF_MIN_VECTORS:
+            return None
+        ivf = self._load_ivf()
+        if ivf is None or len(ivf[1]) < 0.75 * n:
+            self._build_ivf()
+            ivf = self._ivf
+        centroids, assign = ivf
+        probe = np.argsort(-(centroids @ q))[:nprobe]
+        rows = np.flatnonzero(np.isin(assign, probe))
+        tail = np.arange(len(assign), n)  # rows added since the last training
+        return np.concatenate([rows, tail]) if len(tail) else rows
+
+    def approximate_scores(self, q: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Cosine scores of rows from the quantized codes, in blocks to bound the float32 copies."""
+        codes, scales = self.quantized()
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), BLOCK_ROWS):
+            block = rows[start:start + BLOCK_ROWS]
+            scores[start:start + BLOCK_ROWS] = codes[block].astype(np.float32) @ q
+            if scales is not None:
+                scores[start:start + BLOCK_ROWS] *= scales[block]
+        return scores
+
+    def search(self, q: np.ndarray, k: int, pre_filter: Optional[dict], nprobe: int,
+               rescore_factor: int = RESCORE_FACTOR) -> List[Tuple[int, float]]:
+        if not self.docs:
+            return []
+        mat = self.vectors()
+        rows = self.candidates(q, nprobe)
+        if rows is None:
+            rows = np.arange(len(mat))
+        if pre_filter:
+            rows = np.array([r for r in rows if _match(self.docs[r]["metadata"], pre_filter)], dtype=np.int64)
+        if not len(rows):
+            return []
+        shortlist = k * max(1, rescore_factor)
+        if self.quantization and len(rows) > shortlist:
+            # Shortlist from the compact codes, then rescore exactly from the float32 rows
+            approx = self.approximate_scores(q, rows)
+            rows = np.sort(rows[np.argpartition(-approx, shortlist - 1)[:shortlist]])
+        scores = mat[rows] @ q
+        top = np.argpartition(-scores, min(k, len(rows)) - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+
+class LocalVectorStore(VectorStore):
+    """In-process vector store: exact NumPy search for small shards, IVF for large ones.
+
+    Data is sharded by (user_id, thread_id) and persisted under ``path`` so a
+    restart reuses the stored vectors instead of re-embedding. With int8 or
+    float16 quantization, candidates are scored from a compact copy and the
+    top k * rescore_factor are rescored exactly from float32.
+    """
+
+    def __init__(self, embedding: Embeddings, path: str = LOCAL_INDEX_DIR, nprobe: int = IVF_NPROBE,
+                 quantization: str = VECTOR_QUANTIZATION, rescore_factor: int = RESCORE_FACTOR):
+        self._embedding = embedding
+        self.path = path
+        self.nprobe = nprobe
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self._shards = {}
+        self._lock = threading.Lock()  # guards _shards only; each shard has its own lock
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def _shard(self, name: str) -> Shard:
+        with self._lock:
+            if name not in self._shards:
+                self._shards[name] = Shard(os.path.join(self.path, name), self.quantization)
+            return self._shards[name]
+
+    def _shards_for(self, pre_filter: Optional[dict]) -> List[Shard]:
+        user_id, thread_id = _equals(pre_filter, "user_id"), _equals(pre_filter, "thread_id")
+        if user_id is not None and thread_id is not None:
+            return [self._shard(shard_name(user_id, thread_id))]
+        names = os.listdir(self.path) if os.path.isdir(self.path) else []
+        # A scratch directory left by an interrupted rewrite() still names its shard, which recovers it
+        return [self._shard(n) for n in sorted({n.split(".")[0] for n in names})]
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = np.asarray(self._embedding.embed_documents(texts), dtype=np.float32)
+        return self.add_vectors(texts, vectors, metadatas, ids=kwargs.get("ids"))
+
+    def add_vectors(self, texts: List[str], vectors: np.ndarray, metadatas: List[dict], ids: Optional[List[str]] = None) -> List[str]:
+        """Store precomputed embeddings."""
+        if not texts:
+            return []
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        ids = ids or [uuid.uuid4().hex for _ in texts]
+        grouped = {}
+        for i, meta in enumerate(metadatas):
+            grouped.setdefault(shard_name(meta.get("user_id"), meta.get("thread_id")), []).append(i)
+        for name, rows in grouped.items():
+            shard = self._shard(name)
+            with shard.lock:
+                shard.append(
+                    vectors[rows],
+                    [{"id": ids[i], "text": texts[i], "metadata": metadatas[i]} for i in rows],
+                )
+        return ids
+
+    def similarity_search_with_score(self, query: str, k: int = 4, pre_filter: Optional[dict] = None,
+                                     include_embeddings: bool = False, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, pre_filter,
+                                                           include_embeddings)
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               pre_filter: Optional[dict] = None,
+                                               include_embeddings: bool = False) -> List[Tuple[Document, float]]:
+        """Top k records with (1 + cos) / 2 scores; include_embeddings adds metadata["embedding"] as Atlas does."""
+        q = np.asarray(embedding, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        hits = []
+        # Shards are already per (user_id, thread_id); only other conditions need row checks
+        residual = {key: v for key, v in (pre_filter or {}).items() if key not in ("user_id", "thread_id")}
+        for shard in self._shards_for(pre_filter):
+            with shard.lock:
+                for row, score in shard.search(q, k, residual, self.nprobe, self.rescore_factor):
+                    doc = shard.docs[row]
+                    metadata = doc["metadata"]
+                    if include_embeddings:
+                        metadata = {**metadata, "embedding": shard.vectors()[row].tolist()}
+                    # Same (1 + cos) / 2 scale as Atlas cosine scores
+                    hits.append((Document(page_content=doc["text"], metadata=metadata, id=doc["id"]),
+                                 (1.0 + score) / 2.0))
+        hits.sort(key=lambda h: -h[1])
+        return hits[:k]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, kwargs.get("pre_filter"))]
+
+    def _similarity_search_with_relevance_scores(self, query: str, k: int = 4, **kwargs: Any):
+        return self.similarity_search_with_score(query, k, **kwargs)
+
+    def delete(self, ids: Optional[List[str]] = None, pre_filter: Optional[dict] = None, **kwargs: Any) -> bool:
+        """Delete by ids and/or filter."""
+        self.remove(pre_filter, ids)
+        return True
+
+    def remove(self, pre_filter: Optional[dict] = None, ids: Optional[List[str]] = None) -> int:
+        """Delete by filter and/or ids; returns the number of records removed."""
+        wanted = set(ids or [])
+        removed = 0
+        for shard in self._shards_for(pre_filter):
+            with shard.lock:
+                keep = [i for i, d in enumerate(shard.docs)
+                        if not ((not wanted or d["id"] in wanted) and _match(d["metadata"], pre_filter))]
+                if len(keep) != len(shard):
+                    removed += len(shard) - len(keep)
+                    shard.rewrite(keep)
+        return removed
+
+    def records(self, pre_filter: Optional[dict] = None) -> List[dict]:
+        """Stored records (id, text, metadata) matching a filter, without their vectors."""
+        found = []
+        for shard in self._shards_for(pre_filter):
+            with shard.lock:
+                found.extend(d for d in shard.docs if _match(d["metadata"], pre_filter))
+        return found
+
+    def update_metadata(self, ids: List[str], fields: dict, pre_filter: Optional[dict] = None) -> int:
+        """Set metadata fields on the given records; pre_filter narrows the shards searched."""
+        wanted = set(ids)
+        updated = 0
+        for shard in self._shards_for(pre_filter):
+            with shard.lock:
+                changed = [d for d in shard.docs if d["id"] in wanted]
+                for d in changed:
+                    d["metadata"].update(fields)
+                if changed:
+                    shard.save_docs()
+                    updated += len(changed)
+        return updated
+
+    def groups(self) -> dict:
+        """Record counts per (user_id, thread_id, doc_hash)."""
+        counts = {}
+        for shard in self._shards_for(None):
+            with shard.lock:
+                for d in shard.docs:
+                    meta = d["metadata"]
+                    key = (meta.get("user_id"), meta.get("thread_id"), meta.get("doc_hash"))
+                    counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def find(self, pre_filter: Optional[dict] = None) -> List[Tuple[dict, np.ndarray]]:
+        """Stored (record, unit vector) pairs matching a filter."""
+        found = []
+        for shard in self._shards_for(pre_filter):
+            with shard.lock:
+                mat = shard.vectors()
+                found.extend((d, np.array(mat[i])) for i, d in enumerate(shard.docs) if _match(d["metadata"], pre_filter))
+        return found
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   path: str = LOCAL_INDEX_DIR, **kwargs: Any) -> "LocalVectorStore":
+        store = cls(embedding, path=path)
+        store.add_texts(texts, metadatas)
+        return store
@@ -1,30 +1,101 @@
-from fastapi import FastAPI, UploadFile, Form
+from fastapi import FastAPI, UploadFile, Form, HTTPException
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from typing import List
 import shutil
 import os
+import json
 import uuid
+import tempfile
+import aiofiles
+import xxhash
+import threading
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
+import rag_agent
+import async_agent
 from rag_agent import (
     load_document_and_build_retriever,
-    run_agent_with_query,
     clear_session,
-    db
+    get_embedding_cache,
+    response_cache,
+    web_cache,
+    get_summarizer,
+    ensure_indexes,
+    compact_vectors,
+    get_db,
+    get_ingest_jobs_coll
 )
+from async_agent import arun_agent_with_query, astream_agent_with_query, drain_background
+from lazy import WarmUp
+from llm_scheduler import Busy, scheduler as llm_scheduler
+from ingest_jobs import IngestQueue, QueueFull
+import pdf_parsing
+import telemetry
+from bson import ObjectId
 
 USER_ID = "demo_user"  # Simulate logged-in user
+UPLOAD_CHUNK_BYTES = 1 << 20
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+WARM_UP_ON_START = os.getenv("WARM_UP_ON_START", "1") == "1"
+VECTOR_COMPACT_INTERVAL_HOURS = float(os.getenv("VECTOR_COMPACT_INTERVAL_HOURS", "0"))  # 0 disables the schedule
 app = FastAPI(title="Multi-Thread RAG Chatbot")
+app.add_middleware(telemetry.TelemetryMiddleware)
+ingest_queue = IngestQueue(load_document_and_build_retriever, get_ingest_jobs_coll)
+warm_up = WarmUp({**rag_agent.WARM_UP_STEPS, "indexes": ensure_indexes, **async_agent.WARM_UP_STEPS},
+                 optional=rag_agent.OPTIONAL_WARM_UP_STEPS + async_agent.OPTIONAL_WARM_UP_STEPS)
+
+@app.on_event("startup")
+def start_warm_up():
+    """Build clients and load the model in the background; the server accepts requests meanwhile."""
+    if WARM_UP_ON_START:
+        warm_up.start()
+        return
+    try:
+        ensure_indexes()
+    except Exception as e:
+        print(f"[WARN] Could not create MongoDB indexes: {e}")
+
+_stop_compaction = threading.Event()
+
+def compaction_loop():
+    while not _stop_compaction.wait(VECTOR_COMPACT_INTERVAL_HOURS * 3600):
+        try:
+            print(f"[INFO] Vector compaction: {compact_vectors()}")
+        except Exception as e:
+            print(f"[WARN] Vector compaction failed: {e}")
+
+@app.on_event("startup")
+def start_compaction():
+    if VECTOR_COMPACT_INTERVAL_HOURS > 0:
+        threading.Thread(target=compaction_loop, name="vector-compaction", daemon=True).start()
+
+@app.on_event("shutdown")
+def shutdown_ingest_queue():
+    _stop_compaction.set()
+    ingest_queue.shutdown()
+    pdf_parsing.shutdown()
+
+@app.on_event("shutdown")
+async def flush_chat_writes():
+    await drain_background()
+    for writes in (rag_agent.get_chat_writes.peek(), rag_agent.get_vector_writes.peek()):
+        if writes:
+            writes.close()
+    summarizer = get_summarizer.peek()
+    if summarizer:
+        summarizer.shutdown()
 
 @app.get("/threads")
 def list_threads():
     """List all threads of the current user."""
-    threads = db["session_docs"].find({"user_id": USER_ID})
+    threads = get_db()["session_docs"].find({"user_id": USER_ID}, {"_id": 0, "thread_id": 1})
     return [doc["thread_id"] for doc in threads]
 
 @app.post("/threads/new")
 def create_thread():
     """Create a new chat thread."""
     thread_id = str(uuid.uuid4())
-    db["session_docs"].insert_one({ 
+    get_db()["session_docs"].insert_one({ 
         "user_id": USER_ID,
         "thread_id": thread_id,
         "document_name": None,
@@ -34,55 +105,158 @@ def create_thread():
 
 @app.post("/upload")
 async def upload_document(file: UploadFile, thread_id: str = Form(...)):
-    """Upload PDF and process it."""
+    """Upload PDF and queue it for processing."""
+    telemetry.tag(thread_id=thread_id)
+    save_path = None
     try:
-        # Read the file contents
-        contents = await file.read()
-        
-        # Create a proper temporary file path using the original filename
         # Extract just the filename without the full path
         original_filename = os.path.basename(file.filename) if file.filename else "uploaded_file.pdf"
-        save_path = f"temp_{original_filename}"
-        
-        # Write the contents to the temporary file
-        with open(save_path, "wb") as f:
-            f.write(contents)
-        
-        # Process the document
-        load_document_and_build_retriever(save_path, user_id=USER_ID, thread_id=thread_id)
-        
-        # Clean up the temporary file
-        if os.path.exists(save_path):
+
+        # Stream the upload to a unique temporary file in chunks, hashing as we go
+        fd, save_path = tempfile.mkstemp(prefix="upload_", suffix=".pdf")
+        os.close(fd)
+        digest = xxhash.xxh3_128()
+        async with aiofiles.open(save_path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                digest.update(chunk)
+                await f.write(chunk)
+
+        # Process the document in the background; the worker removes the temporary file
+        job, coalesced = ingest_queue.submit(save_path, USER_ID, thread_id, original_filename, digest.hexdigest())
+        if coalesced:
             os.remove(save_path)
-            
-        return {"status": "✅ Document uploaded and processed successfully."}
-    
+
+        return {"status": "⏳ Document queued for processing.", "job_id": job.id, "coalesced": coalesced}
+
+    except QueueFull:
+        os.remove(save_path)
+        return {"status": "❌ Upload failed: too many documents are being processed, try again shortly."}
     except Exception as e:
         # Clean up temporary file in case of error
-        if 'save_path' in locals() and os.path.exists(save_path):
+        if save_path and os.path.exists(save_path):
             os.remove(save_path)
         return {"status": f"❌ Upload failed: {str(e)}"}
 
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Progress of an upload job."""
+    job = ingest_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
 @app.post("/chat")
-def chat(query: str = Form(...), thread_id: str = Form(...)):
+async def chat(query: str = Form(...), thread_id: str = Form(...)):
     """Chat in a thread."""
+    telemetry.tag(thread_id=thread_id)
     if not thread_id:
         return {"error": "Thread ID required."}
-    answer = run_agent_with_query(query, USER_ID, thread_id)
-    return {"response": answer}
+    # The turn's id is fixed up front so clients can track history without refetching it
+    turn_id = ObjectId()
+    try:
+        answer = await arun_agent_with_query(query, USER_ID, thread_id, turn_id)
+    except Busy as e:
+        return busy_response(e)
+    return {"response": answer, "id": str(turn_id)}
+
+def busy_response(e: Busy) -> JSONResponse:
+    """Fast 503 while the LLM scheduler is shedding load."""
+    return JSONResponse({"error": str(e), "busy": True}, status_code=503,
+                        headers={"Retry-After": str(max(1, round(e.retry_after)))})
+
+def sse(data: dict, event: str = None) -> str:
+    """Format one Server-Sent Event."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(query: str = Form(...), thread_id: str = Form(...)):
+    """Chat in a thread, streaming answer tokens as Server-Sent Events."""
+    telemetry.tag(thread_id=thread_id)
+    if not thread_id:
+        return {"error": "Thread ID required."}
+
+    # Shed before the stream starts, so a saturated backend still answers with a status code
+    if llm_scheduler.overloaded():
+        return busy_response(Busy(1.0))
+    turn_id = ObjectId()
+
+    async def events():
+        try:
+            async for token in astream_agent_with_query(query, USER_ID, thread_id, turn_id):
+                yield sse({"token": token})
+            yield sse({"id": str(turn_id)}, event="done")
+        except Busy as e:
+            yield sse({"error": str(e), "busy": True}, event="error")
+        except Exception as e:
+            yield sse({"error": str(e)}, event="error")
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.get("/threads/{thread_id}/history")
-def get_thread_history(thread_id: str):
-    """Fetch chat history of thread."""
-    chats = db["chat_history"].find({"user_id": USER_ID, "thread_id": thread_id}).sort("_id", 1)
+def get_thread_history(thread_id: str, after_id: str = None, limit: int = HISTORY_PAGE_SIZE):
+    """Fetch chat history of thread, oldest first, one page of turns after after_id."""
+    query = {"user_id": USER_ID, "thread_id": thread_id}
+    if after_id:
+        if not ObjectId.is_valid(after_id):
+            raise HTTPException(status_code=400, detail="Invalid after_id.")
+        query["_id"] = {"$gt": ObjectId(after_id)}
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    chats = list(get_db()["chat_history"].find(query, {"query": 1, "response": 1}).sort("_id", 1).limit(limit))
+    # Turns still in the write buffer are newer than anything stored, so they only extend the page
+    pending = rag_agent.pending_turns(USER_ID, thread_id, query["_id"]["$gt"] if after_id else None)
+    seen = {chat["_id"] for chat in chats}
+    chats = sorted(chats + [t for t in pending if t["_id"] not in seen], key=lambda t: t["_id"])[:limit]
     history = []
+    last_id = None
     for chat in chats:
-        history.append({"role": "user", "content": chat["query"]})
-        history.append({"role": "assistant", "content": chat["response"]})
-    return history
+        last_id = str(chat["_id"])
+        history.append({"role": "user", "content": chat["query"], "id": last_id})
+        history.append({"role": "assistant", "content": chat["response"], "id": last_id})
+    return {
+        "messages": history,
+        "next_after_id": last_id if len(history) == 2 * limit else None,
+        "last_id": last_id or after_id,
+    }
 
 @app.post("/threads/{thread_id}/reset")
 def reset_thread(thread_id: str):
-    """Clear chat history & doc of thread."""
+    """Clear chat history, doc and stored chunks of thread."""
     clear_session(USER_ID, thread_id)
-    return {"status": "Thread reset."}
\ No newline at end of file
+    return {"status": "Thread reset."}
+
+@app.get("/stats")
+def stats():
+    """Cache and write buffer counters."""
+    writes = {name: getter.peek().stats() for name, getter in
+              (("chat_history", rag_agent.get_chat_writes), ("vector_store", rag_agent.get_vector_writes))
+              if getter.peek()}
+    return {"embedding_cache": get_embedding_cache().stats(), "response_cache": response_cache.stats(),
+            "web_search_cache": web_cache.stats(), "write_behind": writes}
+
+@app.post("/maintenance/compact")
+def compact():
+    """Delete stored chunks of reset threads and replaced documents."""
+    return compact_vectors()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Stage and request latency histograms in the Prometheus text format."""
+    return PlainTextResponse(telemetry.render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/ready")
+def ready():
+    """200 once clients, model and graphs are warmed up; 503 with per-component status until then.
+
+    Without warm-up nothing is built ahead of time, so only the Mongo connection is checked.
+    """
+    if not WARM_UP_ON_START:
+        try:
+            get_db().command("ping")
+        except Exception as e:
+            return JSONResponse({"ready": False, "components": {"mongo": f"failed: {e}"}}, status_code=503)
+        return {"ready": True, "components": {"mongo": "ready"}}
+    warm_up.start()  # retries failed components
+    status = warm_up.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
@@ -0,0 +1,75 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from langchain_core.documents import Document
+
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+PARALLEL_PARSE_MIN_PAGES = int(os.getenv("PARALLEL_PARSE_MIN_PAGES", "64"))
+PAGES_PER_TASK = int(os.getenv("PAGES_PER_TASK", "16"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Shared parse pool, started on first use. Spawned so workers don't inherit client threads."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _parse_range(pdf_path: str, start: int, stop: int):
+    """Extract (text, metadata) for pages [start, stop) in a worker process.
+
+    Metadata is built the way PyPDFLoader builds it, so chunks look the same
+    whichever path parsed the file.
+    """
+    from pypdf import PdfReader
+    from langchain_community.document_loaders.parsers.pdf import _purge_metadata
+    reader = PdfReader(pdf_path)
+    total = len(reader.pages)
+    doc_metadata = _purge_metadata({"producer": "PyPDF", "creator": "PyPDF", "creationdate": ""}
+                                   | dict(reader.metadata or {})
+                                   | {"source": pdf_path, "total_pages": total})
+    return [
+        (reader.pages[i].extract_text().strip(),
+         {**doc_metadata, "page": i, "page_label": reader.page_labels[i]})
+        for i in range(start, min(stop, total))
+    ]
+
+
+def count_pages(pdf_path: str) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(pdf_path).pages)
+
+
+def iter_pages(pdf_path: str):
+    """Yield pages in order, fanning page ranges out to worker processes for large files."""
+    total = count_pages(pdf_path) if PARSE_WORKERS > 1 else 0
+    if total < PARALLEL_PARSE_MIN_PAGES:
+        from langchain_community.document_loaders import PyPDFLoader
+        yield from PyPDFLoader(pdf_path).lazy_load()
+        return
+
+    pool = _get_pool()
+    futures = [pool.submit(_parse_range, pdf_path, start, start + PAGES_PER_TASK)
+               for start in range(0, total, PAGES_PER_TASK)]
+    try:
+        for future in futures:
+            for text, metadata in future.result():
+                yield Document(page_content=text, metadata=metadata)
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -1,33 +1,131 @@
 import os
+import re
+import time
 import pymongo
+import xxhash
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from typing import TypedDict, Annotated, Sequence
-from langgraph.graph import StateGraph, END
+from typing import TypedDict, Annotated, Sequence, List
 from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage, AIMessage
 from operator import add as add_messages
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_mongodb import MongoDBAtlasVectorSearch
 from langchain_core.tools import tool
-from groq import Groq
-from tavily import TavilyClient
+from embeddings import get_embedding_model
+from embedding_cache import EmbeddingCache, CachedEmbeddings, chunk_hash, file_hash
+from retriever_registry import RetrieverRegistry
+from lexical_index import LexicalStore
+from response_cache import ResponseCache
+from context_packer import ContextPacker, get_encoding
+from summarizer import ConversationSummarizer
+from web_cache import WebSearchCache
+from pdf_parsing import iter_pages
+from vector_backends import (create_vectorstore, count_vectors, copy_vectors, add_embedded, VECTOR_BACKEND, chunk_key,
+                             stored_chunks, retag_vectors, delete_vectors, vector_groups)
+from write_behind import WriteBehindBuffer
+from ingest_jobs import JOB_RETENTION_SECONDS
+from telemetry import span, timed_iter, bind_context
+from lazy import lazy
+from llm_scheduler import scheduler as llm_scheduler, LLM_TIMEOUT_SECONDS
 
 # Load environment variables
 load_dotenv()
 
-# MongoDB setup
+# Clients are built on first use (or by warm_up), so importing this module is cheap
 MONGO_URI = os.getenv("MONGODB_URI")
-mongo = pymongo.MongoClient(MONGO_URI)
-db = mongo["Rag_Agent"]
-vec_coll = db["vector_store"]
-chat_coll = db["chat_history"]
 
-# LLM & Web Clients
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-tavily_client = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+# MongoDB setup
+@lazy
+def get_db():
+    return pymongo.MongoClient(MONGO_URI)["Rag_Agent"]
+
+def get_chat_coll():
+    return get_db()["chat_history"]
+
+def get_ingest_jobs_coll():
+    return get_db()["ingest_jobs"]
+
+# Chat turns and Atlas vectors are written behind the request, in unordered insert_many batches
+@lazy
+def get_chat_writes():
+    return WriteBehindBuffer(get_chat_coll(), "chat_history")
+
+@lazy
+def get_vector_writes():
+    return WriteBehindBuffer(get_db()["vector_store"], "vector_store")
+
+def pending_turns(user_id: str, thread_id: str, after_id=None) -> list:
+    """Turns of a thread still waiting in the write buffer, oldest first."""
+    writes = get_chat_writes.peek()
+    if writes is None:
+        return []
+    return writes.pending(lambda t: t["user_id"] == user_id and t["thread_id"] == thread_id
+                          and (after_id is None or t["_id"] > after_id))
+
+def merge_pending_turns(turns: list, user_id: str, thread_id: str, limit: int = None) -> list:
+    """Add buffered turns to turns read from Mongo (oldest first), keeping the last limit."""
+    seen = {t["_id"] for t in turns}
+    merged = turns + [t for t in pending_turns(user_id, thread_id) if t["_id"] not in seen]
+    merged.sort(key=lambda t: t["_id"])
+    return merged[-limit:] if limit else merged
 
-retriever = None  # Global per-thread retriever (in production, you'd isolate better)
+# LLM & Web Clients
+@lazy
+def get_groq_client():
+    from groq import Groq
+    # Retries are left to llm_scheduler, which also paces them against the rate limits
+    return Groq(api_key=os.getenv("GROQ_API_KEY"), max_retries=0, timeout=LLM_TIMEOUT_SECONDS)
+
+@lazy
+def get_tavily_client():
+    from tavily import TavilyClient
+    return TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+
+# Embeddings, cached by chunk content so re-uploads skip the model
+@lazy
+def get_embedding_cache():
+    return EmbeddingCache(get_db()["embedding_cache"])
+
+@lazy
+def get_embedder():
+    return CachedEmbeddings(get_embedding_model(), get_embedding_cache())
+
+# Web results cached per normalized query, identical in-flight searches shared
+web_cache = WebSearchCache()
+
+# Answers cached per document, matched exactly or by query similarity (the model loads on first use)
+response_cache = ResponseCache(get_embedding_model().embed_query)
+
+# Vector store shared by all sessions; retrievers are scoped per (user_id, thread_id)
+@lazy
+def get_vectorstore():
+    return create_vectorstore(get_embedder(), get_db()["vector_store"])
+
+# BM25 index per thread for exact tokens (tickers, line items, fiscal years), fused with vector hits
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+lexical_store = LexicalStore() if HYBRID_SEARCH else None
+# Over-fetched candidates are narrowed with MMR and overlapping chunks merged before they reach the prompt
+MMR_SEARCH = os.getenv("MMR_SEARCH", "1") == "1"
+
+@lazy
+def get_retrievers():
+    return RetrieverRegistry(get_vectorstore(), lexical=lexical_store, diversify=MMR_SEARCH)
+
+_session = ContextVar("rag_session", default=(None, None))
+
+@contextmanager
+def bind_session(user_id: str, thread_id: str):
+    """Bind retriever_tool to a user's thread for the duration of the block."""
+    token = _session.set((user_id, thread_id))
+    try:
+        yield
+    finally:
+        _session.reset(token)
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "128"))
+SUMMARY_PAGES = 3
+# Threads whose ingestion started this recently are left alone by compaction
+VECTOR_COMPACT_GRACE_SECONDS = int(os.getenv("VECTOR_COMPACT_GRACE_SECONDS", "3600"))
 
 def summarize_document(pages):
     """Summarize first few pages."""
@@ -36,7 +134,11 @@ def summarize_document(pages):
 @tool
 def retriever_tool(query: str) -> str:
     """Retrieve document excerpts."""
-    docs = retriever.invoke(query)
+    user_id, thread_id = _session.get()
+    if thread_id is None:
+        return "No relevant document info found."
+    with span("retrieval"):
+        docs = get_retrievers().get(user_id, thread_id).invoke(query)
     if not docs:
         return "No relevant document info found."
     return "\n\n".join(f"Excerpt {i+1}: {doc.page_content}" for i, doc in enumerate(docs))
@@ -44,149 +146,542 @@ def retriever_tool(query: str) -> str:
 tools = [retriever_tool]
 tools_dict = {t.name: t for t in tools}
 
+MAX_GRAPH_STEPS = int(os.getenv("MAX_GRAPH_STEPS", "6"))
+MAX_SUB_QUESTIONS = 3
+_tool_pool = ThreadPoolExecutor(max_workers=int(os.getenv("TOOL_WORKERS", "4")), thread_name_prefix="tool")
+
 class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], add_messages]
+    user_id: str
+    thread_id: str
+    context: dict
+    memory: List[str]
+    token_usage: dict
+    retrieval_ms: float
 
 def should_continue(state: AgentState):
-    return hasattr(state['messages'][-1], 'tool_calls') and state['messages'][-1].tool_calls
+    return hasattr(state['messages'][-1], 'tool_calls') and bool(state['messages'][-1].tool_calls)
+
+def split_questions(query: str) -> list:
+    """Independent sub-questions of a query, each retrieved separately."""
+    parts = [p.strip() for p in re.split(r"(?<=\?)\s+", query) if p.strip()]
+    return parts[:MAX_SUB_QUESTIONS] if len(parts) > 1 else [query]
+
+def plan_retrieval(state: AgentState) -> AgentState:
+    """Request document excerpts for each sub-question when the thread has a document."""
+    context = state.get("context")
+    if not state.get("thread_id") or (context is not None and not context.get("document_name")):
+        return {"messages": []}
+    human = next((m for m in reversed(state["messages"]) if isinstance(m, HumanMessage)), None)
+    if human is None:
+        return {"messages": []}
+    calls = [{"name": "retriever_tool", "args": {"query": q}, "id": f"retrieve_{i}"}
+             for i, q in enumerate(split_questions(human.content))]
+    return {"messages": [AIMessage(content="", tool_calls=calls)]}
+
+GROQ_MODEL = "llama3-70b-8192"
 
 def groq_llm(prompt: str) -> str:
-    """Call Groq LLM."""
-    chat = groq_client.chat.completions.create(
-        model="llama3-70b-8192",
-        messages=[{"role": "user", "content": prompt}]
-    )
+    """Call Groq LLM through the scheduler; raises llm_scheduler.Busy when it is saturated."""
+    tokens = llm_scheduler.estimate(prompt)
+    with llm_scheduler.admitted(tokens), span("llm"):
+        chat = llm_scheduler.call(lambda: get_groq_client().chat.completions.create(
+            model=GROQ_MODEL,
+            messages=[{"role": "user", "content": prompt}]
+        ))
+    llm_scheduler.settle(tokens, getattr(getattr(chat, "usage", None), "total_tokens", 0))
     return chat.choices[0].message.content
 
+def _memory_turns(messages) -> list:
+    """'User: ...' / 'AI: ...' lines for the conversation before the latest question."""
+    return [
+        f"User: {m.content}" if isinstance(m, HumanMessage) else f"AI: {m.content}"
+        for m in messages
+        if isinstance(m, (HumanMessage, AIMessage))
+    ]
+
+def _split_excerpts(text: str) -> list:
+    return re.split(r"\n\n(?=Excerpt \d+: )", text)
+
+def pack_prompt(query: str, instruction: str, memory_turns=(), document_name=None, document_summary=None,
+                excerpts=(), web_result=None, conversation_summary=None):
+    """Build a prompt within PROMPT_TOKEN_BUDGET; returns (prompt, per-section token usage).
+
+    Sections are filled in priority order: question, excerpts (best first), document summary,
+    web results, conversation summary, then memory (newest turns first, stopping at the first
+    turn that does not fit so the kept turns are consecutive).
+    """
+    packed, usage = (ContextPacker()
+                     .add("question", [f"Question: {query}\n{instruction}"], required=True)
+                     .add("excerpts", list(excerpts))
+                     .add("summary", [document_summary] if document_name else [])
+                     .add("web", [web_result] if web_result else [])
+                     .add("conversation", [conversation_summary] if conversation_summary else [])
+                     .add("memory", list(reversed(memory_turns)), truncate=False, contiguous=True)
+                     .pack())
+
+    memory = "\n".join(reversed(packed["memory"]))
+    prompt = ""
+    if packed["conversation"]:
+        prompt += f"Conversation so far (summary):\n{packed['conversation'][0]}\n\n"
+    prompt += f"{memory}\n\n"
+    if document_name:
+        prompt += f"Document: {document_name}\nSummary:\n{''.join(packed['summary'])}\n\n"
+    if packed["excerpts"]:
+        prompt += "Document Excerpts:\n" + "\n\n".join(packed["excerpts"]) + "\n\n"
+    if packed["web"]:
+        prompt += f"Web Search Results:\n{packed['web'][0]}\n\n"
+    prompt += packed["question"][0]
+    trimmed = [f"{name} (truncated {u['truncated']}, dropped {u['dropped']})"
+               for name, u in usage.items() if isinstance(u, dict) and (u["truncated"] or u["dropped"])]
+    if trimmed:
+        print(f"[INFO] Prompt trimmed to {usage['total']}/{usage['budget']} tokens: " + ", ".join(trimmed))
+    return prompt, usage
+
+def collect_excerpts(messages) -> list:
+    """Excerpt texts from retriever_tool results, without duplicates across calls."""
+    seen, excerpts = set(), []
+    for m in messages:
+        if isinstance(m, ToolMessage) and m.name == "retriever_tool":
+            for excerpt in _split_excerpts(m.content):
+                text = re.sub(r"^Excerpt \d+: ", "", excerpt)
+                if text not in seen and text != "No relevant document info found.":
+                    seen.add(text)
+                    excerpts.append(f"Excerpt {len(excerpts) + 1}: {text}")
+    return excerpts
+
 def call_llm(state: AgentState) -> AgentState:
     """LLM Reasoning."""
     human = next((m for m in reversed(state["messages"]) if isinstance(m, HumanMessage)), None)
     query = human.content if human else ""
+    excerpts = collect_excerpts(state["messages"])
 
-    doc_text = "\n\n".join(m.content for m in state["messages"]
-                           if isinstance(m, ToolMessage) and m.name == "retriever_tool")
-    memory = "\n".join(
-        f"User: {m.content}" if isinstance(m, HumanMessage) else f"AI: {m.content}"
-        for m in state["messages"][:-1]
-        if isinstance(m, (HumanMessage, AIMessage))
-    )
+    context = state.get("context")
+    if context is not None:
+        base = compose_prompt(query, {**context, "excerpts": excerpts})
+        return {"messages": [AIMessage(content=groq_llm(base))], "token_usage": context.get("token_usage")}
+
+    # Memory is built once per run rather than on every loop iteration
+    memory = state.get("memory")
+    if memory is None:
+        memory = _memory_turns(state["messages"][:-1])
 
-    base = f"{memory}\n\n"
-    if doc_text:
-        base += f"Document Excerpts:\n{doc_text}\n\n"
-    base += f"Question: {query}\nAnswer with sources."
+    base, usage = pack_prompt(query, "Answer with sources.", memory_turns=memory, excerpts=excerpts)
 
     resp = groq_llm(base)
-    return {"messages": state["messages"] + [AIMessage(content=resp)]}
+    return {"messages": [AIMessage(content=resp)], "memory": memory, "token_usage": usage}
 
-def take_action(state: AgentState) -> AgentState:
-    """Execute tools."""
-    msgs = state["messages"].copy()
-    for call in state["messages"][-1].tool_calls:
-        res = tools_dict[call.name].invoke(call.args["query"])
-        msgs.append(ToolMessage(tool_call_id=call.id, name=call.name, content=res))
-    return {"messages": msgs}
-
-graph = StateGraph(AgentState)
-graph.add_node("llm", call_llm)
-graph.add_node("tool", take_action)
-graph.add_conditional_edges("llm", should_continue, {True: "tool", False: END})
-graph.add_edge("tool", "llm")
-graph.set_entry_point("llm")
-rag_agent = graph.compile()
+def _run_tool(call: dict, user_id: str, thread_id: str) -> ToolMessage:
+    with bind_session(user_id, thread_id):
+        res = tools_dict[call["name"]].invoke(call["args"]["query"])
+    return ToolMessage(tool_call_id=call["id"], name=call["name"], content=res)
 
-def run_agent_with_query(query: str, user_id: str, thread_id: str):
-    """Agent with multi-user & multi-thread chat support, with natural responses."""
-    document_name, document_summary = get_document_context(user_id, thread_id)
-    recent_chats = list(chat_coll.find({"user_id": user_id, "thread_id": thread_id}).sort("_id", -1).limit(5))
-    recent_chats = list(reversed(recent_chats))
+def take_action(state: AgentState) -> AgentState:
+    """Execute tools, running independent calls concurrently."""
+    start = time.perf_counter()
+    calls = state["messages"][-1].tool_calls
+    if len(calls) == 1:
+        msgs = [_run_tool(calls[0], state.get("user_id"), state.get("thread_id"))]
+    else:
+        run = bind_context(_run_tool)
+        msgs = list(_tool_pool.map(lambda call: run(call, state.get("user_id"), state.get("thread_id")), calls))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return {"messages": msgs, "retrieval_ms": (state.get("retrieval_ms") or 0.0) + elapsed_ms}
+
+def build_graph(generate: bool = True):
+    """plan -> tool -> llm; without generate, the graph stops after retrieval."""
+    from langgraph.graph import StateGraph, END
+    graph = StateGraph(AgentState)
+    graph.add_node("plan", plan_retrieval)
+    graph.add_node("tool", take_action)
+    after_tool = "llm" if generate else END
+    if generate:
+        graph.add_node("llm", call_llm)
+        graph.add_conditional_edges("llm", should_continue, {True: "tool", False: END})
+    graph.add_conditional_edges("plan", should_continue, {True: "tool", False: after_tool})
+    graph.add_edge("tool", after_tool)
+    graph.set_entry_point("plan")
+    return graph.compile()
+
+@lazy
+def get_agent_graph():
+    return build_graph()
+
+@lazy
+def get_retrieval_graph():
+    return build_graph(generate=False)
+
+GRAPH_CONFIG = {"recursion_limit": MAX_GRAPH_STEPS}
+
+def compose_prompt(query: str, context: dict) -> str:
+    """Assemble the chat prompt from memory, document context and web results.
+
+    The per-section token usage is left in context["token_usage"].
+    """
+    document_name = context["document_name"]
+    web_result = context["web_result"]
+    # One piece per turn, so the budget never keeps a question without its answer
+    memory_turns = [f"User: {chat['query']}\nAI: {chat['response']}" for chat in context["recent_chats"]]
 
-    messages = []
-    for chat in recent_chats:
-        messages.append(HumanMessage(content=chat["query"]))
-        messages.append(AIMessage(content=chat["response"]))
-    messages.append(HumanMessage(content=query))
+    if document_name or web_result:
+        instruction = "Answer with sources if applicable."
+    else:
+        instruction = "Answer concisely and naturally. No need for sources or extra formalities."
+
+    prompt, context["token_usage"] = pack_prompt(
+        query, instruction,
+        memory_turns=memory_turns,
+        document_name=document_name,
+        document_summary=context["document_summary"],
+        excerpts=context.get("excerpts", ()),
+        web_result=web_result,
+        conversation_summary=context["conversation_summary"],
+    )
+    return prompt
+
+# Older turns are folded into a running summary on the thread's session_docs record
+@lazy
+def get_summarizer():
+    return ConversationSummarizer(get_db()["session_docs"], get_chat_coll(), groq_llm, pending=pending_turns)
+
+def fetch_context(query: str, user_id: str, thread_id: str) -> dict:
+    """Fetch the thread's document, recent turns and, if needed, web results."""
+    with span("session_fetch"):
+        doc = get_session_doc(user_id, thread_id)
+    with span("history_fetch"):
+        recent_chats = list(get_chat_coll().find({"user_id": user_id, "thread_id": thread_id}, CHAT_PROJECTION)
+                            .sort("_id", -1).limit(get_summarizer().window))
+    recent_chats = merge_pending_turns(list(reversed(recent_chats)), user_id, thread_id, get_summarizer().window)
+    recent_chats = ConversationSummarizer.unsummarized(recent_chats, doc["summary_checkpoint"])
 
     web_result = None
     if force_web_search_if_needed(query):
-        print("[INFO] Auto-fetching web search results...")
         web_result = web_search_tool(query)
 
-    memory = "\n".join(
-        f"User: {m.content}" if isinstance(m, HumanMessage) else f"AI: {m.content}"
-        for m in messages[:-1]
-        if isinstance(m, (HumanMessage, AIMessage))
-    )
-
-    prompt = f"{memory}\n\n"
-    if document_name:
-        prompt += f"Document: {document_name}\nSummary:\n{document_summary}\n\n"
-    if web_result:
-        prompt += f"Web Search Results:\n{web_result}\n\n"
-
-    prompt += f"Question: {query}\n"
-
-    if document_name or web_result:
-        prompt += "Answer with sources if applicable."
-    else:
-        prompt += "Answer concisely and naturally. No need for sources or extra formalities."
-
-    answer = groq_llm(prompt)
-
-    chat_coll.insert_one({
-        "user_id": user_id,
-        "thread_id": thread_id,
-        "query": query,
-        "response": answer
-    })
+    return {**doc, "recent_chats": recent_chats, "web_result": web_result}
+
+def cache_scope(context: dict, user_id: str, thread_id: str):
+    """Response cache scope: what besides the question goes into the prompt.
+
+    A thread's opening question depends only on its document, so it is shared
+    by every thread with the same file. Once the thread has history, follow-ups
+    ("Why?") depend on it, so the scope is that thread at that point of the
+    conversation. Returns None when the answer should not be cached (web
+    results are time-sensitive).
+    """
+    if context["web_result"]:
+        return None
+    if context["recent_chats"] or context["conversation_summary"]:
+        memory = xxhash.xxh3_64()
+        memory.update((context["conversation_summary"] or "").encode("utf-8"))
+        for chat in context["recent_chats"]:
+            memory.update(f"\0{chat['query']}\0{chat['response']}".encode("utf-8"))
+        return f"thread:{user_id}:{thread_id}:{memory.hexdigest()}"
+    return context["doc_hash"] or f"thread:{user_id}:{thread_id}"
+
+def save_turn(user_id: str, thread_id: str, query: str, answer: str, retrieval_ms: float = None):
+    """Queue one question/answer pair for writing; blocks only while the write buffer is full."""
+    with span("history_write"):
+        get_chat_writes().add({
+            "user_id": user_id,
+            "thread_id": thread_id,
+            "query": query,
+            "response": answer,
+            "retrieval_ms": retrieval_ms
+        })
+    get_summarizer().schedule(user_id, thread_id)
 
-    return ""  # or a string, dict, or list as appropriate
-
-def web_search_tool(query: str) -> str:
-    """Live web search using Tavily."""
-    resp = tavily_client.search(query=query, max_results=3, search_depth="advanced")
+def run_agent_with_query(query: str, user_id: str, thread_id: str):
+    """Agent with multi-user & multi-thread chat support, with natural responses."""
+    context = fetch_context(query, user_id, thread_id)
+    scope = cache_scope(context, user_id, thread_id)
+    with span("cache_lookup"):
+        answer = response_cache.get(query, scope) if scope else None
+    retrieval_ms = None
+    if answer is None:
+        state = get_agent_graph().invoke(
+            {"messages": [HumanMessage(content=query)], "user_id": user_id, "thread_id": thread_id,
+             "context": context},
+            config=GRAPH_CONFIG
+        )
+        answer = state["messages"][-1].content
+        retrieval_ms = state.get("retrieval_ms")
+        if scope:
+            response_cache.put(query, scope, answer, (user_id, thread_id))
+    save_turn(user_id, thread_id, query, answer, retrieval_ms)
+    return answer
+
+def format_web_results(resp: dict) -> str:
     results = resp.get("results", [])
     if not results:
         return "No web search results found."
     return "\n\n".join(f"{r['title']}\n{r['url']}\n{r['content']}" for r in results)
 
+def _tavily_search(query: str) -> str:
+    resp = get_tavily_client().search(query=query, max_results=3, search_depth="advanced")
+    return format_web_results(resp)
+
+def web_search_tool(query: str) -> str:
+    """Live web search using Tavily."""
+    with span("web_search"):
+        return web_cache.search(query, _tavily_search)
+
 def force_web_search_if_needed(query: str) -> bool:
     """Detect if web search needed."""
     keywords = ["latest", "recent", "today", "breaking", "news", "result", "match", "score", "live", "date", "current", "happening", "won", "win", "now"]
     return any(k in query.lower() for k in keywords)
 
-def load_document_and_build_retriever(pdf_path: str, user_id: str, thread_id: str):
-    """Load PDF, store vectors per user & thread."""
-    global retriever
-    document_name = os.path.basename(pdf_path)
-    loader = PyPDFLoader(pdf_path)
-    pages = loader.load()
-    document_summary = summarize_document(pages)
-
-    splits = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200).split_documents(pages)
-
-    vectorstore = MongoDBAtlasVectorSearch.from_documents(
-        documents=splits,
-        embedding=HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2"),
-        collection=vec_coll,
-        index_name="default"
-    )
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
+def _no_progress(stage: str, count: int):
+    pass
+
+def iter_chunk_batches(pages, batch_size: int, on_page=None):
+    """Split pages as they arrive and yield chunks in batches of batch_size."""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, add_start_index=True)
+    batch = []
+    for page in timed_iter(pages, "pdf_load"):
+        if on_page:
+            on_page(page)
+        with span("split"):
+            batch.extend(splitter.split_documents([page]))
+        while len(batch) >= batch_size:
+            yield batch[:batch_size]
+            batch = batch[batch_size:]
+    if batch:
+        yield batch
+
+def load_document_and_build_retriever(pdf_path: str, user_id: str, thread_id: str, document_name: str = None,
+                                      progress=_no_progress):
+    """Load PDF, store vectors per user & thread. progress(stage, count) reports each stage."""
+    document_name = document_name or os.path.basename(pdf_path)
+    with span("file_hash"):
+        doc_hash = file_hash(pdf_path)
+    owner = {"user_id": user_id, "thread_id": thread_id}
+    db = get_db()
+    vectorstore = get_vectorstore()
+    embedder = get_embedder()
+    writes = get_vector_writes() if VECTOR_BACKEND == "atlas" else None
+
+    # Only a thread whose ingestion of this file completed, and still holds every chunk, is copied from
+    known, source = None, None
+    for candidate in db["session_docs"].find({"doc_hash": doc_hash, "chunk_count": {"$gt": 0}, "ingesting": {"$ne": True}},
+                                             {"user_id": 1, "thread_id": 1, "document_summary": 1, "chunk_count": 1}):
+        query = {"doc_hash": doc_hash, "user_id": candidate["user_id"], "thread_id": candidate["thread_id"]}
+        if count_vectors(vectorstore, query) == candidate["chunk_count"]:
+            known, source = candidate, query
+            break
+    reused = source is not None
+    if reused:
+        # Same document already parsed and embedded: reuse its vectors for this thread
+        print(f"[INFO] Reusing stored vectors for {document_name}")
+        document_summary = known["document_summary"]
+        chunk_count = known["chunk_count"]
+        target = {"doc_hash": doc_hash, **owner}
+        if count_vectors(vectorstore, target) != chunk_count:
+            with span("vector_copy"):
+                # A partial copy left by an interrupted attempt is replaced, not topped up
+                delete_vectors(vectorstore, target)
+                copy_vectors(vectorstore, source, owner)
+                if lexical_store:
+                    lexical_store.index(user_id, thread_id).rewrite(lambda d: d["metadata"].get("doc_hash") != doc_hash)
+                    lexical_store.copy(source, owner, doc_hash)
+            # The source may have been reset or replaced while it was copied
+            reused = count_vectors(vectorstore, target) == chunk_count
+        if reused:
+            for stage in ("chunks", "embedded", "stored"):
+                progress(stage, chunk_count)
+    if not reused:
+        # Stream pages -> chunks -> embed + insert in batches, so memory stays flat and the
+        # first chunks are searchable before the last page is parsed
+        db["session_docs"].update_one(owner, {"$set": {"ingesting": True, "ingest_started": time.time()},
+                                              "$unset": {"chunk_count": ""}}, upsert=True)
+        # Chunks already stored for this thread (an earlier version, or an interrupted attempt) are kept
+        # when they reappear unchanged at the same position, instead of being embedded and inserted again
+        previous = stored_chunks(vectorstore, owner)
+        kept, inserted = [], []
+        if lexical_store:
+            # The lexical index is rebuilt from every chunk, so drop what an interrupted attempt left
+            lexical_store.index(user_id, thread_id).rewrite(lambda d: d["metadata"].get("doc_hash") != doc_hash)
+        summary_pages = []
+        counts = {"parsed_pages": 0, "chunks": 0, "embedded": 0, "stored": 0, "reused": 0}
+
+        def publish_summary():
+            db["session_docs"].update_one(
+                owner,
+                {"$set": {"document_name": document_name, "document_summary": summarize_document(summary_pages),
+                          "doc_hash": doc_hash, "ingesting": True}},
+                upsert=True
+            )
+
+        def on_page(page):
+            counts["parsed_pages"] += 1
+            progress("parsed_pages", counts["parsed_pages"])
+            if len(summary_pages) < SUMMARY_PAGES:
+                summary_pages.append(page)
+                if len(summary_pages) == SUMMARY_PAGES:
+                    publish_summary()
+
+        for batch in iter_chunk_batches(iter_pages(pdf_path), INGEST_BATCH_SIZE, on_page):
+            counts["chunks"] += len(batch)
+            progress("chunks", counts["chunks"])
+            for split in batch:
+                split.metadata.update(owner)
+                split.metadata["doc_hash"] = doc_hash
+                split.metadata["chunk_hash"] = chunk_hash(split.page_content, embedder.engine.model_name)
+
+            fresh = []
+            for split in batch:
+                stored_id = previous.pop(chunk_key(split.metadata), None)
+                if stored_id is None:
+                    fresh.append(split)
+                else:
+                    kept.append(stored_id)
+            if len(fresh) < len(batch):
+                counts["reused"] += len(batch) - len(fresh)
+                progress("reused", counts["reused"])
+
+            if fresh:
+                texts = [split.page_content for split in fresh]
+                with span("embed"):
+                    vectors = embedder.embed_documents(texts)
+                counts["embedded"] += len(vectors)
+                progress("embedded", counts["embedded"])
+                with span("vector_insert"):
+                    inserted += add_embedded(vectorstore, texts, vectors, [split.metadata for split in fresh], writes)
+            if lexical_store:
+                with span("lexical_index"):
+                    lexical_store.add(user_id, thread_id, [split.page_content for split in batch],
+                                      [split.metadata for split in batch])
+            counts["stored"] += len(batch)
+            progress("stored", counts["stored"])
+        if writes:
+            # Searches may only see the document as complete once all its vectors have landed;
+            # WriteFailed fails the job if any of them were dropped
+            with span("vector_flush"):
+                writes.flush(ids=inserted)
+        document_summary = summarize_document(summary_pages)
+        chunk_count = counts["stored"]
+        retag_vectors(vectorstore, kept, {"doc_hash": doc_hash}, owner)
+    retire_other_versions(vectorstore, user_id, thread_id, doc_hash)
+    get_retrievers().invalidate(user_id, thread_id)
+    response_cache.invalidate_thread(user_id, thread_id)
 
     db["session_docs"].update_one(
-        {"user_id": user_id, "thread_id": thread_id},
-        {"$set": {"document_name": document_name, "document_summary": document_summary}},
+        owner,
+        {"$set": {"document_name": document_name, "document_summary": document_summary, "doc_hash": doc_hash,
+                  "chunk_count": chunk_count, "ingesting": False}},
         upsert=True
     )
 
+def retire_other_versions(vectorstore, user_id: str, thread_id: str, doc_hash: str) -> int:
+    """Delete a thread's chunks that belong to any document version but doc_hash."""
+    with span("vector_prune"):
+        removed = delete_vectors(vectorstore, {"user_id": user_id, "thread_id": thread_id, "doc_hash": {"$ne": doc_hash}})
+        if lexical_store:
+            lexical_store.keep_document(user_id, thread_id, doc_hash)
+    if removed:
+        print(f"[INFO] Removed {removed} chunks of replaced documents from thread {thread_id}")
+    return removed
+
+def compact_vectors() -> dict:
+    """Delete stored chunks and lexical indexes that no thread's current document points at.
+
+    That covers reset threads, replaced documents, failed ingestions and
+    untagged chunks. Threads ingesting for less than
+    VECTOR_COMPACT_GRACE_SECONDS are skipped.
+    """
+    live, active = {}, set()
+    cutoff = time.time() - VECTOR_COMPACT_GRACE_SECONDS
+    fields = {"_id": 0, "user_id": 1, "thread_id": 1, "doc_hash": 1, "ingesting": 1, "ingest_started": 1}
+    for doc in get_db()["session_docs"].find({}, fields):
+        owner = (doc.get("user_id"), doc.get("thread_id"))
+        if doc.get("ingesting") and (doc.get("ingest_started") or 0) > cutoff:
+            active.add(owner)
+        else:
+            live[owner] = doc.get("doc_hash")
+    vectorstore = get_vectorstore()
+    removed = 0
+    with span("vector_compact"):
+        for (user_id, thread_id, doc_hash), count in vector_groups(vectorstore).items():
+            owner = (user_id, thread_id)
+            if owner in active or (doc_hash is not None and live.get(owner) == doc_hash):
+                continue
+            removed += delete_vectors(vectorstore, {"user_id": user_id, "thread_id": thread_id, "doc_hash": doc_hash})
+        lexical_removed = lexical_store.compact(live, active) if lexical_store else 0
+    return {"vectors_removed": removed, "lexical_indexes_removed": lexical_removed}
+
+SESSION_DOC_FIELDS = ("document_name", "document_summary", "doc_hash", "conversation_summary", "summary_checkpoint")
+SESSION_PROJECTION = {"_id": 0, **{key: 1 for key in SESSION_DOC_FIELDS}}
+CHAT_PROJECTION = {"query": 1, "response": 1}
+
+def ensure_indexes():
+    """Create the indexes behind the per-request queries (idempotent)."""
+    db = get_db()
+    db["chat_history"].create_index([("user_id", 1), ("thread_id", 1), ("_id", 1)])
+    db["session_docs"].create_index([("user_id", 1), ("thread_id", 1)])
+    db["session_docs"].create_index("doc_hash", sparse=True)
+    db["vector_store"].create_index([("user_id", 1), ("thread_id", 1), ("doc_hash", 1)])
+    db["embedding_cache"].create_index("last_used")
+    # Finished upload jobs expire JOB_RETENTION_SECONDS after they end
+    db["ingest_jobs"].create_index("expire_at", expireAfterSeconds=JOB_RETENTION_SECONDS)
+
+def get_session_doc(user_id: str, thread_id: str) -> dict:
+    """Document and conversation summary fields of a thread (None where unset)."""
+    doc = get_db()["session_docs"].find_one({"user_id": user_id, "thread_id": thread_id}, SESSION_PROJECTION) or {}
+    return {key: doc.get(key) for key in SESSION_DOC_FIELDS}
+
 def get_document_context(user_id: str, thread_id: str):
     """Get doc summary for chat."""
-    doc = db["session_docs"].find_one({"user_id": user_id, "thread_id": thread_id})
+    doc = get_db()["session_docs"].find_one({"user_id": user_id, "thread_id": thread_id},
+                                            {"document_name": 1, "document_summary": 1})
     if doc:
         return doc["document_name"], doc["document_summary"]
     return None, None
 
 def clear_session(user_id: str, thread_id: str):
-    """Clear chat & doc."""
-    chat_coll.delete_many({"user_id": user_id, "thread_id": thread_id})
-    db["session_docs"].delete_one({"user_id": user_id, "thread_id": thread_id})
+    """Clear chat, doc and the thread's stored chunks."""
+    # Buffered writes would otherwise land after the delete
+    for writes in (get_chat_writes(), get_vector_writes.peek()):
+        if writes:
+            writes.flush()
+    get_chat_coll().delete_many({"user_id": user_id, "thread_id": thread_id})
+    get_db()["session_docs"].delete_one({"user_id": user_id, "thread_id": thread_id})
+    delete_vectors(get_vectorstore(), {"user_id": user_id, "thread_id": thread_id})
+    if lexical_store:
+        lexical_store.delete(user_id, thread_id)
+    get_retrievers().invalidate(user_id, thread_id)
+    response_cache.invalidate_thread(user_id, thread_id)
+
+# Built in the background at startup so the first request doesn't pay for them
+WARM_UP_STEPS = {
+    "mongo": lambda: get_db().command("ping"),
+    "groq": get_groq_client,
+    "tavily": get_tavily_client,
+    "embedding_model": lambda: get_embedding_model().embed_query("warm up"),
+    "vector_store": get_retrievers,
+    "graphs": lambda: (get_agent_graph(), get_retrieval_graph()),
+    "tokenizer": get_encoding,
+}
+# Web search is only used for some questions, so a missing Tavily key must not keep the app unready
+OPTIONAL_WARM_UP_STEPS = ("tavily",)
+
+# Names other modules imported before initialization became lazy
+_LAZY_ATTRIBUTES = {
+    "db": get_db,
+    "chat_coll": get_chat_coll,
+    "vec_coll": lambda: get_db()["vector_store"],
+    "groq_client": get_groq_client,
+    "tavily_client": get_tavily_client,
+    "embedding_cache": get_embedding_cache,
+    "embedder": get_embedder,
+    "vectorstore": get_vectorstore,
+    "retrievers": get_retrievers,
+    "summarizer": get_summarizer,
+    "rag_agent": get_agent_graph,
+    "retrieval_graph": get_retrieval_graph,
+}
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,110 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.92"))
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop surrounding punctuation."""
+    return re.sub(r"\s+", " ", query.lower()).strip(" ?!.,;:")
+
+
+def query_anchors(query: str) -> frozenset:
+    """Numbers (years, amounts, quarters) and ticker-like all-caps words, which a semantic hit must share.
+
+    Embeddings barely separate "revenue in 2022" from "revenue in 2023", or AAPL from MSFT.
+    """
+    numbers = re.findall(r"\d+(?:[.,]\d+)*", query)
+    tickers = re.findall(r"\$?\b[A-Z]{2,5}\b", query)
+    return frozenset(numbers + [t.lstrip("$") for t in tickers])
+
+
+class ResponseCache:
+    """LLM answers cached per scope, matched exactly or by query embedding similarity.
+
+    The scope must capture everything besides the question that shapes the
+    answer (see rag_agent.cache_scope). Semantic matches also need the same
+    query_anchors.
+    """
+
+    def __init__(self, embed_query, ttl: int = RESPONSE_CACHE_TTL, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 threshold: float = RESPONSE_CACHE_SIMILARITY):
+        self.embed_query = embed_query
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._entries = OrderedDict()  # (scope, normalized query) -> entry dict
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embed_query(text), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for key in [k for k, e in self._entries.items() if e["created"] < cutoff]:
+            del self._entries[key]
+
+    def get(self, query: str, scope: str):
+        """Cached answer for a query within a document scope, or None."""
+        key = (scope, normalize_query(query))
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry["answer"]
+            anchors = query_anchors(query)
+            candidates = [(k, e) for k, e in self._entries.items() if k[0] == scope and e["anchors"] == anchors]
+        if candidates:
+            scores = np.stack([e["vector"] for _, e in candidates]) @ self._embed(key[1])
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                with self._lock:
+                    best_key = candidates[best][0]
+                    if best_key in self._entries:
+                        self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                return candidates[best][1]["answer"]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, query: str, scope: str, answer: str, owner: tuple):
+        """Cache an answer; owner is the (user_id, thread_id) that produced it."""
+        normalized = normalize_query(query)
+        vector = self._embed(normalized)
+        with self._lock:
+            self._entries[(scope, normalized)] = {
+                "answer": answer, "vector": vector, "anchors": query_anchors(query), "owner": owner,
+                "created": time.time()
+            }
+            self._entries.move_to_end((scope, normalized))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_thread(self, user_id: str, thread_id: str):
+        """Drop answers produced by a thread, e.g. when its document changes."""
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e["owner"] == (user_id, thread_id)]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        total = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.semantic_hits) / total if total else 0.0,
+            "entries": len(self._entries),
+        }
@@ -0,0 +1,69 @@
+import os
+import threading
+import functools
+from collections import OrderedDict
+from lexical_index import HybridRetriever
+from excerpt_selection import DiverseRetriever, MMR_FETCH_K
+from vector_backends import candidate_vectors
+
+RETRIEVER_CACHE_SIZE = int(os.getenv("RETRIEVER_CACHE_SIZE", "256"))
+RETRIEVER_K = int(os.getenv("RETRIEVER_K", "5"))
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "20"))
+
+
+def session_filter(user_id: str, thread_id: str) -> dict:
+    """Vector search pre-filter restricting results to one user's thread."""
+    return {"user_id": {"$eq": user_id}, "thread_id": {"$eq": thread_id}}
+
+
+class RetrieverRegistry:
+    """Per-(user_id, thread_id) retrievers built on demand and kept warm in an LRU.
+
+    With a lexical store, each retriever fuses fetch_k vector hits with
+    fetch_k BM25 hits. With diversify, candidates_k of those are narrowed to
+    k by MMR and overlapping chunks are merged; otherwise the top k are kept.
+    """
+
+    def __init__(self, vectorstore, k: int = RETRIEVER_K, max_entries: int = RETRIEVER_CACHE_SIZE,
+                 lexical=None, fetch_k: int = HYBRID_FETCH_K, diversify: bool = True,
+                 candidates_k: int = MMR_FETCH_K):
+        self.vectorstore = vectorstore
+        self.k = k
+        self.lexical = lexical
+        self.fetch_k = fetch_k
+        self.diversify = diversify
+        self.candidates_k = candidates_k
+        self.max_entries = max_entries
+        self._retrievers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, thread_id: str):
+        """Return the retriever for a session, building it if needed."""
+        key = (user_id, thread_id)
+        with self._lock:
+            if key in self._retrievers:
+                self._retrievers.move_to_end(key)
+                return self._retrievers[key]
+        k = self.candidates_k if self.diversify else self.k
+        search_kwargs = {"k": max(k, self.fetch_k) if self.lexical else k, "pre_filter": session_filter(user_id, thread_id)}
+        if self.diversify:
+            search_kwargs["include_embeddings"] = True  # MMR reuses the stored vectors
+        retriever = self.vectorstore.as_retriever(search_kwargs=search_kwargs)
+        if self.lexical is not None:
+            retriever = HybridRetriever(vector_retriever=retriever, lexical_store=self.lexical, user_id=user_id,
+                                        thread_id=thread_id, k=k, fetch_k=self.fetch_k)
+        if self.diversify:
+            owner = {"user_id": user_id, "thread_id": thread_id}
+            retriever = DiverseRetriever(base_retriever=retriever, embeddings=self.vectorstore.embeddings, k=self.k,
+                                         stored_vectors=functools.partial(candidate_vectors, self.vectorstore, owner))
+        with self._lock:
+            self._retrievers[key] = retriever
+            self._retrievers.move_to_end(key)
+            while len(self._retrievers) > self.max_entries:
+                self._retrievers.popitem(last=False)
+        return retriever
+
+    def invalidate(self, user_id: str, thread_id: str):
+        """Drop a session's retriever so the next lookup rebuilds it."""
+        with self._lock:
+            self._retrievers.pop((user_id, thread_id), None)
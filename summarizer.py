@@ -0,0 +1,98 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+RECENT_TURNS = int(os.getenv("RECENT_TURNS", "4"))
+SUMMARY_TRIGGER_TURNS = int(os.getenv("SUMMARY_TRIGGER_TURNS", "4"))
+SUMMARY_MAX_WORDS = int(os.getenv("SUMMARY_MAX_WORDS", "200"))
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and an AI assistant about their documents.
+
+Current summary:
+{summary}
+
+New conversation turns:
+{turns}
+
+Rewrite the summary so it also covers the new turns. Keep facts, figures, names and open questions the user may refer back to. Use at most {max_words} words and reply with the summary only."""
+
+
+class ConversationSummarizer:
+    """Folds older chat turns into a running summary stored on the thread's session_docs record.
+
+    Only turns after the stored checkpoint are summarized, and the newest
+    RECENT_TURNS always stay raw so the prompt carries summary + recent turns.
+    """
+
+    def __init__(self, session_docs, chat_coll, llm, recent_turns: int = RECENT_TURNS,
+                 trigger_turns: int = SUMMARY_TRIGGER_TURNS, pending=None):
+        self.session_docs = session_docs
+        self.chat_coll = chat_coll
+        self.llm = llm
+        self.recent_turns = recent_turns
+        self.trigger_turns = trigger_turns
+        self.pending = pending  # (user_id, thread_id, after_id) -> turns not yet written
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summarize")
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    @property
+    def window(self) -> int:
+        """Turns to fetch for a prompt: the recent ones plus any not yet folded in."""
+        return self.recent_turns + self.trigger_turns
+
+    @staticmethod
+    def unsummarized(recent_chats: list, checkpoint) -> list:
+        """Drop turns already covered by the summary."""
+        if checkpoint is None:
+            return recent_chats
+        return [c for c in recent_chats if c["_id"] > checkpoint]
+
+    def update(self, user_id: str, thread_id: str):
+        """Summarize the turns since the checkpoint once enough have accumulated."""
+        owner = {"user_id": user_id, "thread_id": thread_id}
+        doc = self.session_docs.find_one(owner, {"conversation_summary": 1, "summary_checkpoint": 1})
+        if doc is None:
+            return
+        checkpoint = doc.get("summary_checkpoint")
+        query = {**owner, "_id": {"$gt": checkpoint}} if checkpoint else owner
+        turns = list(self.chat_coll.find(query, {"query": 1, "response": 1}).sort("_id", 1)
+                     .limit(self.window * 4))
+        if self.pending:
+            seen = {t["_id"] for t in turns}
+            turns += [t for t in self.pending(user_id, thread_id, checkpoint) if t["_id"] not in seen]
+            turns.sort(key=lambda t: t["_id"])
+        if len(turns) < self.window:
+            return
+        delta = turns[:-self.recent_turns]
+        summary = self.llm(SUMMARY_PROMPT.format(
+            summary=doc.get("conversation_summary") or "(empty)",
+            turns="\n".join(f"User: {t['query']}\nAI: {t['response']}" for t in delta),
+            max_words=SUMMARY_MAX_WORDS,
+        ))
+        # Only advance from the checkpoint we read, in case another worker got there first
+        self.session_docs.update_one(
+            {**owner, "summary_checkpoint": checkpoint},
+            {"$set": {"conversation_summary": summary, "summary_checkpoint": delta[-1]["_id"]}}
+        )
+
+    def schedule(self, user_id: str, thread_id: str):
+        """Run update in the background, at most once at a time per thread."""
+        key = (user_id, thread_id)
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._pool.submit(self._run, key)
+
+    def _run(self, key):
+        try:
+            self.update(*key)
+        except Exception as e:
+            print(f"[ERROR] Conversation summary failed for thread {key[1]}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
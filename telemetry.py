@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import uuid
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))  # 0 disables the slow-request log
+SLOW_INGEST_MS = float(os.getenv("SLOW_INGEST_MS", "0"))
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+REQUEST_ID_HEADER = "x-request-id"
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram with one series per label set."""
+
+    def __init__(self, name: str, help: str, label_names, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *labels):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += seconds
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.label_names, labels))
+            sep = "," if base else ""
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                total += count
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{bound}"}} {total}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {total}")
+        return lines
+
+
+class Counter:
+    """Prometheus counter with one series per label set."""
+
+    def __init__(self, name: str, help: str, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._series.items())
+        for labels, value in items:
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.label_names, labels))
+            lines.append(f"{self.name}{{{base}}} {value}" if base else f"{self.name} {value}")
+        return lines
+
+
+class Gauge:
+    """Prometheus gauge read from a callback at scrape time."""
+
+    def __init__(self, name: str, help: str, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+stage_seconds = Histogram("rag_stage_seconds", "Time spent in each pipeline stage.", ("stage",))
+request_seconds = Histogram("rag_http_request_seconds", "HTTP request latency until the last body byte.",
+                            ("method", "route", "status"))
+_metrics = [stage_seconds, request_seconds]
+
+
+def register(metric):
+    """Add a metric to the /metrics output; returns it."""
+    _metrics.append(metric)
+    return metric
+
+
+class Trace:
+    """Per-request (or per-ingestion-job) stage timings, keyed by correlation ids."""
+
+    def __init__(self, kind: str, request_id: str = None, thread_id: str = None, **tags):
+        self.kind = kind
+        self.request_id = request_id or uuid.uuid4().hex
+        self.thread_id = thread_id
+        self.tags = tags
+        self.started = time.perf_counter()
+        self.stages = {}  # stage -> [total ms, count]
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, ms: float):
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0.0, 0])
+            entry[0] += ms
+            entry[1] += 1
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def to_dict(self, **extra) -> dict:
+        with self._lock:
+            stages = {name: {"ms": round(ms, 1), "count": count} for name, (ms, count) in self.stages.items()}
+        return {"kind": self.kind, "request_id": self.request_id, "thread_id": self.thread_id, **self.tags,
+                **extra, "total_ms": round(self.elapsed_ms(), 1), "stages": stages}
+
+
+_trace = ContextVar("rag_trace", default=None)
+
+
+def current_trace():
+    return _trace.get()
+
+
+def current_request_id():
+    trace = _trace.get()
+    return trace.request_id if trace else None
+
+
+def tag(thread_id: str = None, **tags):
+    """Attach correlation ids that are only known once the request body is parsed."""
+    trace = _trace.get()
+    if trace is not None:
+        if thread_id is not None:
+            trace.thread_id = thread_id
+        trace.tags.update(tags)
+
+
+def _log_slow(trace: Trace, threshold_ms: float, **extra):
+    if threshold_ms and trace.elapsed_ms() >= threshold_ms:
+        print(f"[WARN] Slow {trace.kind}: {json.dumps(trace.to_dict(**extra))}")
+
+
+@contextmanager
+def trace(kind: str, request_id: str = None, thread_id: str = None, slow_ms: float = SLOW_INGEST_MS, **tags):
+    """Collect the spans of a unit of work that doesn't go through the HTTP middleware."""
+    current = Trace(kind, request_id, thread_id, **tags)
+    token = _trace.set(current)
+    try:
+        yield current
+    finally:
+        _trace.reset(token)
+        _log_slow(current, slow_ms)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a stage into rag_stage_seconds and the current trace, if any."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def record(stage: str, seconds: float):
+    """Record an already measured stage duration."""
+    stage_seconds.observe(seconds, stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(stage, seconds * 1000)
+
+
+def timed_iter(iterable, stage: str):
+    """Yield from iterable, timing each step (e.g. parsing the next page) as stage."""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            record(stage, time.perf_counter() - start)
+        yield item
+
+
+def bind_context(fn):
+    """Wrap fn to run in a copy of the caller's context, so spans in pool threads join the trace."""
+    context = copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(line for metric in list(_metrics) for line in metric.render()) + "\n"
+
+
+class TelemetryMiddleware:
+    """ASGI middleware: one trace per HTTP request, timed until the response body ends.
+
+    Streaming responses are therefore timed to their last token. The request
+    id comes from the X-Request-ID header when given and is echoed back.
+    """
+
+    def __init__(self, app, slow_ms: float = SLOW_REQUEST_MS):
+        self.app = app
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(REQUEST_ID_HEADER.encode(), b"").decode("latin-1") or None
+        current = Trace("request", request_id)
+        token = _trace.set(current)
+        status = [500]
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.encode(), current.request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _trace.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            request_seconds.observe(current.elapsed_ms() / 1000, scope["method"], path, str(status[0]))
+            _log_slow(current, self.slow_ms, method=scope["method"], route=path, status=status[0])
@@ -0,0 +1,133 @@
+import os
+import numpy as np
+from bson.binary import Binary, BinaryVectorDtype
+from local_vector_store import LocalVectorStore
+
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "atlas")  # "atlas" or "local"
+# "binary" stores Atlas embeddings as packed float32 BSON vectors (~3x smaller than arrays of doubles)
+ATLAS_VECTOR_ENCODING = os.getenv("ATLAS_VECTOR_ENCODING", "array")
+
+
+def create_vectorstore(embedding, collection):
+    """Build the configured vector store."""
+    if VECTOR_BACKEND == "local":
+        return LocalVectorStore(embedding)
+    if VECTOR_BACKEND != "atlas":
+        raise ValueError(f"Unknown VECTOR_BACKEND: {VECTOR_BACKEND}")
+    from langchain_mongodb import MongoDBAtlasVectorSearch
+    return MongoDBAtlasVectorSearch(collection=collection, embedding=embedding, index_name="default")
+
+
+def count_vectors(store, query: dict) -> int:
+    """Number of stored chunks matching the metadata query."""
+    if isinstance(store, LocalVectorStore):
+        return len(store.records(query))
+    return store.collection.count_documents(query)
+
+
+def copy_vectors(store, query: dict, owner: dict) -> int:
+    """Duplicate stored chunks matching query under new owner tags, without re-embedding."""
+    if isinstance(store, LocalVectorStore):
+        found = store.find(query)
+        store.add_vectors([d["text"] for d, _ in found], [v for _, v in found],
+                          [{**d["metadata"], **owner} for d, _ in found])
+        return len(found)
+    stored = [{**v, **owner} for v in store.collection.find(query, {"_id": 0})]
+    if stored:
+        store.collection.insert_many(stored, ordered=False)
+    return len(stored)
+
+
+def chunk_key(metadata: dict) -> tuple:
+    """Identity of a chunk within a document version: its content and where it sits."""
+    return metadata.get("chunk_hash"), metadata.get("page"), metadata.get("start_index")
+
+
+def stored_chunks(store, query: dict) -> dict:
+    """Ids of stored chunks matching the metadata query, by chunk_key."""
+    if isinstance(store, LocalVectorStore):
+        return {chunk_key(d["metadata"]): d["id"] for d in store.records(query)}
+    fields = {"_id": 1, "chunk_hash": 1, "page": 1, "start_index": 1}
+    return {chunk_key(d): d["_id"] for d in store.collection.find(query, fields)}
+
+
+def _id_batches(ids: list, size: int = 1000):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def retag_vectors(store, ids: list, fields: dict, owner: dict) -> int:
+    """Set metadata fields on stored chunks of one owner, by id."""
+    if not ids:
+        return 0
+    if isinstance(store, LocalVectorStore):
+        return store.update_metadata(ids, fields, owner)
+    return sum(store.collection.update_many({"_id": {"$in": batch}}, {"$set": fields}).modified_count
+               for batch in _id_batches(ids))
+
+
+def delete_vectors(store, query: dict) -> int:
+    """Delete stored chunks matching the metadata query; returns how many went."""
+    if isinstance(store, LocalVectorStore):
+        return store.remove(query)
+    return store.collection.delete_many(query).deleted_count
+
+
+def vector_groups(store) -> dict:
+    """Stored chunk counts per (user_id, thread_id, doc_hash); None where a tag is missing."""
+    if isinstance(store, LocalVectorStore):
+        return store.groups()
+    pipeline = [{"$group": {"_id": {"user_id": "$user_id", "thread_id": "$thread_id", "doc_hash": "$doc_hash"},
+                            "count": {"$sum": 1}}}]
+    return {(g["_id"].get("user_id"), g["_id"].get("thread_id"), g["_id"].get("doc_hash")): g["count"]
+            for g in store.collection.aggregate(pipeline)}
+
+
+def encode_vector(vector):
+    """Embedding as stored in Atlas, per ATLAS_VECTOR_ENCODING."""
+    if ATLAS_VECTOR_ENCODING == "binary":
+        return Binary.from_vector([float(x) for x in vector], BinaryVectorDtype.FLOAT32)
+    return [float(x) for x in vector]
+
+
+def decode_vector(value) -> np.ndarray:
+    """A stored embedding (array, or BSON binary vector) as float32."""
+    if isinstance(value, Binary):
+        value = value.as_vector().data
+    return np.asarray(value, dtype=np.float32)
+
+
+def candidate_vectors(store, query: dict, docs: list) -> list:
+    """Stored embeddings of retrieved chunks, in order; None where a chunk has none stored.
+
+    Vector hits carry theirs in metadata["embedding"] (include_embeddings);
+    the rest, e.g. BM25-only hits, are looked up by chunk_hash within query.
+    """
+    vectors = [decode_vector(d.metadata["embedding"]) if d.metadata.get("embedding") is not None else None
+               for d in docs]
+    hashes = list({d.metadata["chunk_hash"] for d, v in zip(docs, vectors) if v is None and d.metadata.get("chunk_hash")})
+    if not hashes:
+        return vectors
+    selector = {**query, "chunk_hash": {"$in": hashes}}
+    if isinstance(store, LocalVectorStore):
+        stored = {d["metadata"]["chunk_hash"]: v for d, v in store.find(selector)}
+    else:
+        embedding_key = getattr(store, "_embedding_key", "embedding")
+        stored = {d["chunk_hash"]: decode_vector(d[embedding_key])
+                  for d in store.collection.find(selector, {"chunk_hash": 1, embedding_key: 1})}
+    return [v if v is not None else stored.get(d.metadata.get("chunk_hash")) for d, v in zip(docs, vectors)]
+
+
+def add_embedded(store, texts: list, vectors: list, metadatas: list, writes=None) -> list:
+    """Insert chunks whose embeddings are already computed, through the writes buffer if given; returns their ids."""
+    if not texts:
+        return []
+    if isinstance(store, LocalVectorStore):
+        return store.add_vectors(texts, vectors, metadatas)
+    text_key = getattr(store, "_text_key", "text")
+    embedding_key = getattr(store, "_embedding_key", "embedding")
+    docs = [{text_key: t, embedding_key: encode_vector(v), **m} for t, v, m in zip(texts, vectors, metadatas)]
+    if writes is not None:
+        writes.add_many(docs)
+        return [d["_id"] for d in docs]
+    return store.collection.insert_many(docs, ordered=False).inserted_ids
@@ -0,0 +1,122 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import Future
+from response_cache import normalize_query
+
+WEB_CACHE_NEWS_TTL = int(os.getenv("WEB_CACHE_NEWS_TTL", "300"))
+WEB_CACHE_EVERGREEN_TTL = int(os.getenv("WEB_CACHE_EVERGREEN_TTL", "86400"))
+WEB_CACHE_MAX_ENTRIES = int(os.getenv("WEB_CACHE_MAX_ENTRIES", "2000"))
+
+NEWS_KEYWORDS = ("latest", "recent", "today", "breaking", "news", "live", "score", "now", "current", "happening")
+
+
+def ttl_for(query: str) -> int:
+    """News-like queries go stale quickly; everything else can be kept much longer."""
+    return WEB_CACHE_NEWS_TTL if any(k in query for k in NEWS_KEYWORDS) else WEB_CACHE_EVERGREEN_TTL
+
+
+class WebSearchCache:
+    """TTL cache of normalized query -> results with single-flight deduplication.
+
+    Concurrent identical searches share one in-flight call, from threads
+    (search) and from the event loop (asearch) alike.
+    """
+
+    def __init__(self, max_entries: int = WEB_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = {}  # key -> (expires_at, result)
+        self._inflight = {}  # key -> concurrent.futures.Future
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.saved_seconds = 0.0
+        self._fetch_seconds = 0.0
+
+    def _avg_fetch(self) -> float:
+        return self._fetch_seconds / self.misses if self.misses else 0.0
+
+    def _lookup(self, key: str):
+        """Return (cached result, in-flight future, is_leader) under the lock."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.time():
+                self.hits += 1
+                self.saved_seconds += self._avg_fetch()
+                return entry[1], None, False
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return None, future, False
+            future = Future()
+            self._inflight[key] = future
+            self.misses += 1
+            return None, future, True
+
+    def _store(self, key: str, result, elapsed: float):
+        with self._lock:
+            self._fetch_seconds += elapsed
+            self._entries[key] = (time.time() + ttl_for(key), result)
+            if len(self._entries) > self.max_entries:
+                now = time.time()
+                for k in [k for k, (exp, _) in self._entries.items() if exp <= now]:
+                    del self._entries[k]
+                while len(self._entries) > self.max_entries:
+                    del self._entries[next(iter(self._entries))]
+
+    def _finish(self, key: str, future: Future, result=None, error: Exception = None):
+        with self._lock:
+            self._inflight.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def search(self, query: str, fetch):
+        """Cached fetch(query) for blocking callers."""
+        key = normalize_query(query)
+        result, future, leader = self._lookup(key)
+        if future is None:
+            return result
+        if not leader:
+            return future.result()
+        start = time.perf_counter()
+        try:
+            result = fetch(query)
+        except BaseException as e:  # including cancellation, so followers are never left waiting
+            self._finish(key, future, error=e)
+            raise
+        self._store(key, result, time.perf_counter() - start)
+        self._finish(key, future, result)
+        return result
+
+    async def asearch(self, query: str, afetch):
+        """Cached await afetch(query) for coroutines."""
+        key = normalize_query(query)
+        result, future, leader = self._lookup(key)
+        if future is None:
+            return result
+        if not leader:
+            return await asyncio.wrap_future(future)
+        start = time.perf_counter()
+        try:
+            result = await afetch(query)
+        except BaseException as e:  # including cancellation, so followers are never left waiting
+            self._finish(key, future, error=e)
+            raise
+        self._store(key, result, time.perf_counter() - start)
+        self._finish(key, future, result)
+        return result
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds + self.coalesced * self._avg_fetch(), 3),
+            "entries": len(self._entries),
+        }
@@ -0,0 +1,191 @@
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from bson import ObjectId
+from pymongo import WriteConcern
+from pymongo.errors import BulkWriteError
+from telemetry import record
+
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "256"))
+WRITE_FLUSH_MS = float(os.getenv("WRITE_FLUSH_MS", "200"))
+WRITE_MAX_PENDING = int(os.getenv("WRITE_MAX_PENDING", "20000"))
+WRITE_RETRIES = 3
+DUPLICATE_KEY = 11000
+FAILED_IDS_KEPT = 100000  # ids of dropped documents remembered for flush(ids=...)
+
+
+class WriteFailed(Exception):
+    """Documents a caller flushed were dropped after retries."""
+
+    def __init__(self, name: str, count: int):
+        super().__init__(f"{count} writes to {name} failed")
+        self.count = count
+
+
+def write_concern_from_env() -> WriteConcern:
+    """WRITE_CONCERN_W (a number or e.g. "majority") and WRITE_CONCERN_J ("1" to wait for the journal)."""
+    w = os.getenv("WRITE_CONCERN_W", "1")
+    journal = os.getenv("WRITE_CONCERN_J", "0") == "1"
+    return WriteConcern(w=int(w) if w.isdigit() else w, j=journal or None)
+
+
+class WriteBehindBuffer:
+    """Buffers inserts for one collection and writes them in the background with unordered insert_many.
+
+    A batch is written once batch_size documents are waiting or the oldest
+    has waited flush_ms. add() blocks while max_pending documents are
+    unwritten (backpressure). Documents get their _id on add(), so callers
+    can read their own writes through pending() before they land, and can
+    pass those ids to flush() to learn whether any of them were dropped.
+    """
+
+    def __init__(self, collection, name: str, batch_size: int = WRITE_BATCH_SIZE, flush_ms: float = WRITE_FLUSH_MS,
+                 max_pending: int = WRITE_MAX_PENDING, write_concern: WriteConcern = None):
+        self.collection = collection.with_options(write_concern=write_concern or write_concern_from_env())
+        self.name = name
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_ms / 1000
+        self.max_pending = max(self.batch_size, max_pending)
+        self._queue = []
+        self._inflight = []
+        self._oldest = None
+        self._queued_total = 0
+        self._written_total = 0  # written or given up on, in queue order
+        self._failed_ids = OrderedDict()
+        self._closed = False
+        self._cond = threading.Condition()
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.blocked_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name=f"write-behind-{name}", daemon=True)
+        self._thread.start()
+
+    def _unwritten(self) -> int:
+        return len(self._queue) + len(self._inflight)
+
+    def add_many(self, docs: list, block: bool = True) -> bool:
+        """Queue documents for insertion; returns False instead of waiting when full and not block."""
+        if not docs:
+            return True
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"Write buffer {self.name} is closed")
+            if self._unwritten() + len(docs) > self.max_pending and self._unwritten():
+                if not block:
+                    return False
+                start = time.perf_counter()
+                while self._unwritten() + len(docs) > self.max_pending and self._unwritten():
+                    self._cond.wait()
+                self.blocked_seconds += time.perf_counter() - start
+            if not self._queue:
+                self._oldest = time.monotonic()
+            self._queue.extend(docs)
+            self._queued_total += len(docs)
+            self._cond.notify_all()
+        return True
+
+    def add(self, doc: dict, block: bool = True) -> bool:
+        return self.add_many([doc], block)
+
+    async def aadd(self, doc: dict):
+        """add() for coroutines: only waits on a thread when the buffer is full."""
+        if not self.add(doc, block=False):
+            await asyncio.to_thread(self.add, doc)
+
+    def pending(self, predicate) -> list:
+        """Queued or in-flight documents matching predicate, oldest first."""
+        with self._cond:
+            return [dict(d) for d in self._inflight + self._queue if predicate(d)]
+
+    def flush(self, timeout: float = None, ids=None) -> bool:
+        """Write everything queued so far; returns False on timeout.
+
+        Raises WriteFailed if any document with one of ids was dropped.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            target = self._queued_total
+            self._oldest = float("-inf")  # due now
+            self._cond.notify_all()
+            while self._written_total < target:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            failed = sum(1 for i in ids if i in self._failed_ids) if ids else 0
+        if failed:
+            raise WriteFailed(self.name, failed)
+        return True
+
+    def close(self):
+        """Flush and stop the writer thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _due(self) -> bool:
+        if not self._queue:
+            return False
+        return (len(self._queue) >= self.batch_size or self._closed
+                or time.monotonic() - self._oldest >= self.flush_seconds)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._due():
+                    if self._closed and not self._queue:
+                        return
+                    timeout = None if not self._queue else max(0.0, self._oldest + self.flush_seconds - time.monotonic())
+                    self._cond.wait(timeout)
+                self._inflight = self._queue[:self.batch_size]
+                self._queue = self._queue[self.batch_size:]  # any rest keeps _oldest, so it is due next
+            self._write(self._inflight)
+            with self._cond:
+                self._written_total += len(self._inflight)
+                self._inflight = []
+                self._cond.notify_all()
+
+    def _drop(self, docs: list):
+        with self._cond:
+            self.failed += len(docs)
+            for doc in docs:
+                self._failed_ids[doc["_id"]] = True
+            while len(self._failed_ids) > FAILED_IDS_KEPT:
+                self._failed_ids.popitem(last=False)
+
+    def _write(self, batch: list):
+        start = time.perf_counter()
+        for attempt in range(WRITE_RETRIES):
+            try:
+                self.collection.insert_many(batch, ordered=False)
+                self.written += len(batch)
+                break
+            except BulkWriteError as e:
+                # Unordered: everything but the failed documents was written; duplicates were already written
+                errors = e.details.get("writeErrors", [])
+                lost = [err for err in errors if err.get("code") != DUPLICATE_KEY]
+                self.written += len(batch) - len(lost)
+                if lost:
+                    self._drop([batch[err["index"]] for err in lost])
+                    print(f"[ERROR] {len(lost)} writes to {self.name} failed: {lost[0].get('errmsg')}")
+                break
+            except Exception as e:
+                if attempt == WRITE_RETRIES - 1:
+                    self._drop(batch)
+                    print(f"[ERROR] Dropped {len(batch)} writes to {self.name}: {e}")
+                else:
+                    time.sleep(0.2 * 2 ** attempt)
+        self.batches += 1
+        record(f"bulk_write_{self.name}", time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        with self._cond:
+            queued = self._unwritten()
+        return {"queued": queued, "written": self.written, "batches": self.batches, "failed": self.failed,
+                "blocked_seconds": round(self.blocked_seconds, 3)}